@@ -0,0 +1,99 @@
+"""
+Project: Lightwave Communications
+Authors: Ian MacDougall, Gage Pavia
+Date Created: 18 October 2026
+Last Modified: 18 October 2026
+File Description: Window shown during a call
+Upadte Description:
+Repository: https://github.com/IanDMacDougall/Lightwave
+"""
+
+
+from PySide6.QtCore import QEvent, Signal, Slot
+from PySide6.QtWidgets import QVBoxLayout, QWidget
+
+from UI.videoWidget import VideoWidget
+
+import threading
+
+'''
+Client active window
+ - the client's video fills the window, the user's own camera is shown small in the corner
+'''
+class ClientWindow(QWidget):
+    attach_requested = Signal(object, object)
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.setWindowTitle("Client Communications")
+        self.resize(960, 540)
+        self.videoConnectClass = None
+
+        self.remote_video = VideoWidget(self)
+        self.self_video = VideoWidget(self.remote_video)
+        self.self_video.setFixedSize(240, 135)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.remote_video)
+        self.setLayout(layout)
+
+        # emitted from the call thread, so attach_display runs on the GUI thread
+        self.attach_requested.connect(self.attach_display)
+
+    '''
+    Sends a call's video to this window instead of the cv2 windows
+     - thread safe, the widgets are set up on the GUI thread & the call waits for it before starting its video threads
+    '''
+    def attach(self, videoConnectClass, timeout=5):
+        done = threading.Event()
+        self.attach_requested.emit(videoConnectClass, done)
+        done.wait(timeout)
+
+    @Slot(object, object)
+    def attach_display(self, videoConnectClass, done):
+        self.videoConnectClass = videoConnectClass
+        # before set_display, so every pushed frame is retained by the pool the widgets release it to
+        self.remote_video.frame_pool = self.self_video.frame_pool = videoConnectClass.frame_pool
+        videoConnectClass.set_display(self.remote_video.push_frame, self.self_video.push_frame)
+        self.remote_video.size_listener = videoConnectClass.set_render_size
+        self.remote_video.report_size()
+        self.report_self_view()
+        done.set()
+
+    def detach(self):
+        if self.videoConnectClass is not None:
+            self.videoConnectClass.set_display(None, None)
+            self.remote_video.size_listener = None
+            self.videoConnectClass = None
+
+    '''
+    Tells the call whether the self view can be seen, camera JPEGs are only decoded for it while it can
+    '''
+    def report_self_view(self):
+        if self.videoConnectClass is not None:
+            ratio = self.self_video.devicePixelRatioF()
+            visible = self.isVisible() and not self.isMinimized() and self.self_video.isVisible()
+            self.videoConnectClass.set_self_view(visible, self.self_video.width() * ratio, self.self_video.height() * ratio)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.report_self_view()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.report_self_view()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.WindowStateChange:
+            self.report_self_view()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # self view stays in the bottom right corner
+        self.self_video.move(self.width() - self.self_video.width() - 12, self.height() - self.self_video.height() - 12)
+
+    def closeEvent(self, event):
+        self.detach()
+        super().closeEvent(event)
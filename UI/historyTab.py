@@ -14,6 +14,8 @@ from PySide6.QtWidgets import (QTableWidgetItem, QVBoxLayout, QTableWidget, QHea
 
 from utilities import call_history
 from connection.header import header
+from connection.audio import audioConnect
+from connection.video import videoConnect
 
 class HistoryTab(QWidget):
     def __init__(self, parent=None):
@@ -68,12 +70,24 @@ class AnalyticsTab(QWidget):
         self.audio_packet_loss_label = QLabel("Audio Packet Loss: N/A")
         self.video_frame_rate_label = QLabel("Video Frame Rate: N/A")
         self.video_packet_loss_label = QLabel("Video Packet Loss: N/A")
+        self.input_level_label = QLabel("Input Level: N/A")
+        self.output_level_label = QLabel("Output Level: N/A")
+        self.video_quality_label = QLabel("Video Quality: N/A")
+        self.video_link_label = QLabel("Video Link: N/A")
+        self.video_decision_label = QLabel("Video Rate Decision: N/A")
+        self.video_buffer_label = QLabel("Video Frame Buffers: N/A")
 
         # Add labels to layout
         layout.addWidget(self.audio_latency_label)
         layout.addWidget(self.audio_packet_loss_label)
         layout.addWidget(self.video_frame_rate_label)
         layout.addWidget(self.video_packet_loss_label)
+        layout.addWidget(self.input_level_label)
+        layout.addWidget(self.output_level_label)
+        layout.addWidget(self.video_quality_label)
+        layout.addWidget(self.video_link_label)
+        layout.addWidget(self.video_decision_label)
+        layout.addWidget(self.video_buffer_label)
 
         # Start a timer to refresh analytics data
         self.analytics_timer = QTimer(self)
@@ -89,10 +103,36 @@ class AnalyticsTab(QWidget):
         audio_packet_loss = header.getAudioPacketLoss(self=self)
         video_frame_rate = header.getVideoLatency(self=self)
         video_latency = header.getVideoLatency(self=self)
-        video_packet_loss = header.getVideoPacketLoss(self=self)
+        # loss of the video we receive, measured on the call's receiving header
+        video_packet_loss = 0
+        if videoConnect.active is not None and videoConnect.active.receiver is not None:
+            video_packet_loss = f"{videoConnect.active.receiver.getVideoPacketLoss():.1f} %"
 
         # Updating labels with data
         self.audio_latency_label.setText(f"Audio Latency: {audio_latency}")
         self.audio_packet_loss_label.setText(f"Audio Packet Loss: {audio_packet_loss}")
         self.video_frame_rate_label.setText(f"Video Frame Rate: {video_frame_rate}")
-        self.video_packet_loss_label.setText(f"Video Packet Loss: {video_packet_loss}")
\ No newline at end of file
+        self.video_packet_loss_label.setText(f"Video Packet Loss: {video_packet_loss}")
+
+        # audio level meters of the call in progress
+        if audioConnect.active is not None:
+            levels = audioConnect.active.get_levels()
+            self.input_level_label.setText(f"Input Level: {levels['input']['rms_db']:.1f} dB ( peak {levels['input']['peak_db']:.1f} dB )")
+            self.output_level_label.setText(f"Output Level: {levels['output']['rms_db']:.1f} dB ( peak {levels['output']['peak_db']:.1f} dB )")
+
+        # rate controller of the call in progress, the link figures are what the peer reported about our video
+        if videoConnect.active is not None:
+            video = videoConnect.active
+            rate = video.get_rate_stats()
+            encode = video.get_encode_stats()
+            if encode is not None:
+                self.video_frame_rate_label.setText(f"Video Frame Rate: {encode['fps']:.1f}")
+            self.video_quality_label.setText(f"Video Quality: {rate['width']}x{rate['height']} {rate['fps']} fps, JPEG quality {rate['quality']}")
+            report = rate["report"]
+            if report is not None:
+                rtt = f"{report['rtt'] * 1000:.0f} ms" if report["rtt"] is not None else "N/A"
+                self.video_link_label.setText(f"Video Link: {report['receive_rate'] * 8 / 1000:.0f} kbps received, {report['loss'] * 100:.1f} % lost, rtt {rtt}")
+            if rate["decisions"]:
+                self.video_decision_label.setText(f"Video Rate Decision: {rate['decisions'][-1][1]}")
+            pool = video.get_frame_pool_stats()
+            self.video_buffer_label.setText(f"Video Frame Buffers: {pool['hit_rate'] * 100:.1f} % reused, peak {pool['peak_bytes'] / 2**20:.1f} MiB")
\ No newline at end of file
@@ -14,6 +14,9 @@ from PySide6.QtWidgets import (QVBoxLayout, QHBoxLayout, QPushButton, QDateTimeE
                                QListWidgetItem, QDialog, QGridLayout, QLabel, QLineEdit, QInputDialog,  QWidget)
 
 from utilities import SCHEDULED_CALLS_FILE, save_data, remove_past_scheduled_calls, scheduled_calls, get_call_settings
+from UI.clientWindow import ClientWindow
+
+import threading
 
 class HomeTab(QWidget):
     def __init__(self, parent=None):
@@ -171,7 +174,7 @@ class HomeTab(QWidget):
             callSettings = get_call_settings()
 
             print('Hosting Local')
-            hostLocal(callSettings=callSettings)
+            self.start_call(hostLocal, callSettings=callSettings)
 
     '''
     Runs once Host Public is clicked
@@ -203,7 +206,7 @@ class HomeTab(QWidget):
             callSettings = get_call_settings()
 
             print('Host Public')
-            hostPublic(callSettings=callSettings)
+            self.start_call(hostPublic, callSettings=callSettings)
 
 
     def join_call(self):
@@ -211,7 +214,16 @@ class HomeTab(QWidget):
         if okPressed and len(enteredKey) > 2:
             from joinCall import peer
             callSettings = get_call_settings()
-            peer(enteredKey, callSettings=callSettings)
+            self.start_call(peer, enteredKey, callSettings=callSettings)
+
+    '''
+    Runs a call off the GUI thread & shows its video in a ClientWindow
+    '''
+    def start_call(self, call, *args, **kwargs):
+        self.client_window = ClientWindow()
+        self.client_window.show()
+        call_thread = threading.Thread(target=call, args=args, kwargs=dict(kwargs, display=self.client_window), name="callThread", daemon=True)
+        call_thread.start()
 
     def update_clock(self):
         self.clock_widget.setDateTime(QDateTime.currentDateTime())
@@ -12,6 +12,7 @@ from PySide6.QtCore import Qt
 from PySide6.QtWidgets import (QVBoxLayout, QGroupBox, QComboBox, QFormLayout, QLabel, QCheckBox, QSlider, QWidget, QPushButton, QMessageBox)
 
 from utilities import load_settings, get_audio_input_devices, get_audio_output_devices, get_video_devices, SETTING_FILE
+from connection.audio import audioConnect
 
 import json
 
@@ -190,8 +191,12 @@ class SettingsTab(QWidget):
             settings["outputDevice"] = outputDevice
         if settings["inputVolume"] != inputVolume:
             settings["inputVolume"] = inputVolume
+            if audioConnect.active is not None:
+                audioConnect.active.set_input_volume_level(inputVolume)
         if settings["outputVolume"] != outputVolume:
             settings["outputVolume"] = outputVolume
+            if audioConnect.active is not None:
+                audioConnect.active.set_volume_level(outputVolume)
 
         with open(SETTING_FILE, "w", encoding="utf-8") as f:
             json.dump([settings], f, indent=4)
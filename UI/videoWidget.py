@@ -0,0 +1,85 @@
+"""
+Project: Lightwave Communications
+Authors: Ian MacDougall, Gage Pavia
+Date Created: 18 October 2026
+Last Modified: 18 October 2026
+File Description: Widget that paints video frames inside the Lightwave window
+Upadte Description:
+Repository: https://github.com/IanDMacDougall/Lightwave
+"""
+
+
+from PySide6.QtCore import Qt, QRect, Signal, Slot
+from PySide6.QtGui import QImage, QPainter
+from PySide6.QtWidgets import QWidget
+
+import numpy as np
+
+'''
+Paints BGR NumPy frames
+ - push_frame can be called from any thread, the frame reaches the GUI thread through a queued signal
+ - the QImage wraps the frame's memory without copying, the widget keeps the frame alive while it is shown
+ - with a frame_pool a pushed frame is retained until the next frame replaces it, so its buffer isn't reused while painted
+ - only repaints when a new frame arrives, Qt scales the image to the widget while painting
+ - size_listener is told the widget's size in device pixels whenever it changes, e.g. so frames are decoded at that size
+'''
+class VideoWidget(QWidget):
+    frame_received = Signal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.frame = None
+        self.image = None
+        self.frame_pool = None
+        self.frames_shown = 0
+        self.size_listener = None
+
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self.frame_received.connect(self.set_frame, Qt.QueuedConnection)
+
+    # thread safe, called by the capture & decode threads
+    def push_frame(self, frame):
+        frame_pool = self.frame_pool
+        if frame_pool is not None and frame is not None:
+            frame_pool.retain(frame)
+        self.frame_received.emit(frame)
+
+    @Slot(object)
+    def set_frame(self, frame):
+        if self.frame is not None and self.frame_pool is not None:
+            self.frame_pool.release(self.frame)
+        if frame is None:
+            self.frame = None
+            self.image = None
+            self.update()
+            return
+
+        contiguous = np.ascontiguousarray(frame)
+        if contiguous is not frame and self.frame_pool is not None:
+            self.frame_pool.release(frame)   # the copy is shown, the pooled frame isn't needed
+        frame = contiguous
+        height, width = frame.shape[:2]
+        self.frame = frame
+        self.image = QImage(frame.data, width, height, frame.strides[0], QImage.Format_BGR888)
+        self.frames_shown += 1
+        self.update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.report_size()
+
+    def report_size(self):
+        if self.size_listener is not None:
+            ratio = self.devicePixelRatioF()
+            self.size_listener(self.width() * ratio, self.height() * ratio)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        if self.image is not None:
+            # keep the aspect ratio & center the frame
+            size = self.image.size().scaled(self.size(), Qt.KeepAspectRatio)
+            target = QRect((self.width() - size.width()) // 2, (self.height() - size.height()) // 2, size.width(), size.height())
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.drawImage(target, self.image)
+        painter.end()
@@ -0,0 +1,478 @@
+"""
+Project: Lightwave Communications
+Authors: Ian MacDougall, Gage Pavia
+Date Created: 18 October 2026
+Last Modified: 18 October 2026
+File Description: Micro-benchmarks for the connection hot paths.
+Repository: https://github.com/IanDMacDougall/Lightwave
+"""
+
+from connection.header import header, build_video_payload, payload_size
+from connection.video import encodePipeline, decodeWorker, tileEncoder, simulcastEncoder, framePool
+from connection.audio import (audioConnect, audioRing, lossConcealer, polyphaseResampler, resample_filters, echoCanceller,
+                              encode_audio, audio_struct, FRAME_DURATIONS, WIRE_RATE)
+
+import socket
+import time
+import queue
+import threading
+import tempfile
+import tracemalloc
+import os
+
+import cv2
+import numpy as np
+
+
+VIDEO_FPS = 30
+VIDEO_FRAME_BYTES = 50 * 1024       # typical JPEG frame at quality 40
+AUDIO_RATE = 48000
+AUDIO_BLOCK = 480                   # 10 ms at 48 kHz
+AUDIO_CHANNELS = 2
+DEVICE_BLOCK = 512                  # device callback size that doesn't line up with any frame duration
+UDP_IP_OVERHEAD = 28                # IPv4 + UDP headers
+
+#
+# Helpers
+#
+
+"""
+Opens a sending & a receiving UDP socket on loopback
+"""
+def open_loopback():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.setblocking(False)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return sender, receiver
+
+
+"""
+Empties the receiving socket so the kernel buffer never fills during a run
+"""
+def drain(receiver):
+    try:
+        while True:
+            receiver.recv(65536)
+    except BlockingIOError:
+        pass
+
+
+"""
+Builds one second of traffic: 30 video frames and 100 audio blocks
+"""
+def one_second_of_media():
+    video = [np.random.randint(0, 256, VIDEO_FRAME_BYTES, dtype=np.uint8) for _ in range(VIDEO_FPS)]
+    audio = [np.random.rand(AUDIO_BLOCK, AUDIO_CHANNELS).astype(np.float32) for _ in range(AUDIO_RATE // AUDIO_BLOCK)]
+    return video, audio
+
+
+def print_result(name, rows):
+    print(f"\n{name}")
+    for label, value in rows:
+        print(f"  {label:<44} {value}")
+
+#
+# Benchmarks
+#
+
+"""
+Send path: old header + payload concatenation vs. header.send_data ( pack_into + sendmsg )
+Reports bytes allocated per second of 30 fps video plus 48 kHz audio ( measured with tracemalloc ), and the time to send that second
+ - the old senders already held their payloads as bytes, so both paths start from the payload they were given
+"""
+def bench_send_path(seconds=3):
+    headerClass = header()
+    sender, receiver = open_loopback()
+    addr = receiver.getsockname()
+    video, audio = one_second_of_media()
+    video_bytes, audio_bytes = [frame.tobytes() for frame in video], [block.tobytes() for block in audio]
+
+    def send_concat(data_type, payload):
+        message = headerClass.create_header(data_type, 0, len(payload), 0) + payload
+        sender.sendto(message, addr)
+
+    def send_gather(data_type, payload):
+        headerClass.send_data(socket=sender, addr=addr, data_type=data_type, seq_num=0, data_send=payload, timestamp=0)
+
+    # one second of media, returns bytes allocated by the sends when traced
+    def send_second(send, video_send, audio_send, traced):
+        allocated = 0
+        for data_type, payloads in ((1, video_send), (0, audio_send)):
+            for payload in payloads:
+                if traced:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                send(data_type, payload)
+                if traced:
+                    allocated += tracemalloc.get_traced_memory()[1] - before
+        return allocated
+
+    rows = []
+    for label, send, video_send, audio_send in (("concatenate", send_concat, video_bytes, audio_bytes),
+                                                ("pack_into + sendmsg", send_gather, video, audio)):
+        elapsed = 0.0
+        for _ in range(seconds):
+            start = time.perf_counter()
+            send_second(send, video_send, audio_send, False)
+            elapsed += time.perf_counter() - start
+            drain(receiver)
+
+        tracemalloc.start()
+        allocated = send_second(send, video_send, audio_send, True)
+        tracemalloc.stop()
+        drain(receiver)
+        rows.append((f"{label} bytes allocated / s", f"{allocated / 1e6:.2f} MB"))
+        rows.append((f"{label} send time / media s", f"{elapsed / seconds * 1000:.2f} ms"))
+
+    sender.close()
+    receiver.close()
+    print_result("Send path (30 fps video + 48 kHz audio)", rows)
+
+
+"""
+Audio framing: for each frame duration, packets/s, header overhead on the wire, added latency
+and the cost of packetizing one second of audio captured in DEVICE_BLOCK sized callbacks
+"""
+def bench_audio_framing(codec="pcm16", seconds=3):
+    sender, receiver = open_loopback()
+    addr = receiver.getsockname()
+    captured = np.random.uniform(-0.5, 0.5, (AUDIO_RATE, AUDIO_CHANNELS)).astype(np.float32)
+
+    rows = []
+    for duration in FRAME_DURATIONS:
+        # DTX off, its VAD takes the noise input for silence & would only send silence descriptors
+        audioConnectClass = audioConnect(codec=codec, frame_duration=duration, dtx=False, echo_cancel=False)
+        header_bytes = UDP_IP_OVERHEAD + audioConnectClass.headerClass.header_size + audio_struct.size
+        packet_bytes = header_bytes - audio_struct.size + payload_size(encode_audio(audioConnectClass.capture_frame, audioConnectClass.codec_id))
+
+        elapsed = 0.0
+        for _ in range(seconds):
+            start = time.perf_counter()
+            for offset in range(0, AUDIO_RATE, DEVICE_BLOCK):
+                audioConnectClass.packetize(captured[offset:offset + DEVICE_BLOCK], sender, addr)
+            elapsed += time.perf_counter() - start
+            drain(receiver)
+
+        packets = audioConnectClass.send_seq / seconds
+        rows.append((f"{duration} ms frames", f"{packets:.0f} packets/s, {packet_bytes} B/packet, header overhead {header_bytes / packet_bytes * 100:.1f} %, "
+                                              f"added latency {2 * duration} ms ( capture + playout block ), "
+                                              f"packetize {elapsed / seconds * 1000:.2f} ms / audio s"))
+
+    sender.close()
+    receiver.close()
+    print_result(f"Audio framing ( {codec}, {AUDIO_RATE} Hz stereo, {DEVICE_BLOCK} frame device blocks )", rows)
+
+
+"""
+Builds a voice-like test signal: harmonics of a wandering pitch with a syllable rate envelope
+"""
+def voice_like(seconds, rate=AUDIO_RATE, channels=AUDIO_CHANNELS):
+    t = np.arange(seconds * rate) / rate
+    pitch = 140 + 20 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    signal = sum(np.sin(k * phase) / k for k in range(1, 8)) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2) * 0.2
+    return np.repeat(signal[:, None], channels, axis=1).astype(np.float32)
+
+
+"""
+Loss traces ( True = packet lost ): independent loss and bursty loss from a two state Gilbert-Elliott model
+"""
+def loss_trace(packets, kind, rate, rng):
+    if kind == "random":
+        return rng.random(packets) < rate
+    lost = np.zeros(packets, dtype=bool)
+    bad = False
+    for n in range(packets):
+        bad = rng.random() < (0.5 if bad else rate / 2)
+        lost[n] = bad
+    return lost
+
+
+"""
+Packet loss concealment: plays a voice-like signal through the playout ring over synthetic loss traces
+Compares zero fill against lossConcealer on error energy, clicks ( sample steps far above the signal's own ) and cost per callback
+"""
+def bench_concealment(seconds=10, frame_frames=480):
+    rng = np.random.default_rng(1)
+    signal = voice_like(seconds)
+    packets = len(signal) // frame_frames
+    click_step = 4 * np.abs(np.diff(signal[:, 0])).max()
+
+    rows = []
+    for kind, rate in (("random", 0.02), ("random", 0.05), ("bursty", 0.05)):
+        lost = loss_trace(packets, kind, rate, rng)
+        for label in ("zero fill", "concealment"):
+            ring = audioRing(capacity_frames=AUDIO_RATE, channels=AUDIO_CHANNELS)
+            concealer = lossConcealer(frame_frames=frame_frames, channels=AUDIO_CHANNELS, sample_rate=AUDIO_RATE)
+            played = np.zeros_like(signal)
+            elapsed = 0.0
+            for n in range(packets):
+                block = signal[n * frame_frames:(n + 1) * frame_frames]
+                if not lost[n]:
+                    ring.write(block)
+                out = played[n * frame_frames:(n + 1) * frame_frames]
+                count = ring.read_into(out)
+                if label == "concealment":
+                    start = time.perf_counter()
+                    concealer.process(out, count)
+                    elapsed += time.perf_counter() - start
+
+            error = played - signal
+            snr = 10 * np.log10(np.sum(signal ** 2) / max(np.sum(error ** 2), 1e-12))
+            clicks = int(np.sum(np.abs(np.diff(played[:, 0])) > click_step))
+            cost = f", {elapsed / packets * 1e6:.1f} us/callback" if label == "concealment" else ""
+            rows.append((f"{kind} {rate * 100:.0f} % loss, {label}", f"{lost.mean() * 100:.1f} % lost, SNR {snr:.1f} dB, {clicks} clicks{cost}"))
+
+    print_result(f"Packet loss concealment ( {frame_frames} frame packets, {seconds} s voice-like signal )", rows)
+
+
+"""
+Resampling: CPU per second of audio for common device rates to & from the wire rate, in 10 ms device blocks
+Also the cost of building a filter bank, which is only paid once per rate pair
+"""
+def bench_resampling(seconds=3):
+    rows = []
+    for device in (44100, 32000, 16000):
+        for in_rate, out_rate in ((device, WIRE_RATE), (WIRE_RATE, device)):
+            resample_filters.clear()
+            start = time.perf_counter()
+            resampler = polyphaseResampler(in_rate, out_rate, channels=AUDIO_CHANNELS)
+            build = time.perf_counter() - start
+
+            block = in_rate // 100
+            audio = np.random.uniform(-0.5, 0.5, (in_rate * seconds, AUDIO_CHANNELS)).astype(np.float32)
+            start = time.perf_counter()
+            for offset in range(0, len(audio), block):
+                resampler.process(audio[offset:offset + block])
+            elapsed = time.perf_counter() - start
+            rows.append((f"{in_rate} -> {out_rate} Hz", f"{elapsed / seconds * 1000:.2f} ms CPU / audio s, filter bank {build * 1000:.2f} ms once"))
+
+    print_result(f"Resampling ( polyphase, {AUDIO_CHANNELS} channels )", rows)
+
+
+"""
+Echo canceller: CPU per frame against the frame's real-time budget, and echo return loss enhancement once converged
+The echo is the far-end played through a synthetic room ( 5 ms delay, decaying random impulse response, -20 dB )
+"""
+def bench_echo_canceller(seconds=8, frame_ms=10, tail_ms=80):
+    rng = np.random.default_rng(2)
+    block = AUDIO_RATE * frame_ms // 1000
+    far = voice_like(seconds) + 0.01 * rng.standard_normal((seconds * AUDIO_RATE, AUDIO_CHANNELS)).astype(np.float32)
+    delay = AUDIO_RATE // 200
+    room = np.zeros(AUDIO_RATE * 40 // 1000)
+    room[delay:] = rng.standard_normal(len(room) - delay) * np.exp(-np.arange(len(room) - delay) / (AUDIO_RATE / 160)) * 0.03
+    echo = np.convolve(far[:, 0], room)[:len(far)].astype(np.float32)
+    near = np.repeat(echo[:, None], AUDIO_CHANNELS, axis=1)
+
+    canceller = echoCanceller(frame_frames=block, sample_rate=AUDIO_RATE, tail_ms=tail_ms)
+    frames = len(far) // block
+    elapsed = 0.0
+    for n in range(frames):
+        frame = near[n * block:(n + 1) * block]
+        start = time.perf_counter()
+        canceller.process(frame, far[n * block:(n + 1) * block])
+        elapsed += time.perf_counter() - start
+
+    per_frame = elapsed / frames
+    rows = [("CPU / frame", f"{per_frame * 1e6:.0f} us ( {per_frame / (frame_ms / 1000) * 100:.1f} % of the {frame_ms} ms budget )"),
+            ("ERLE after convergence", f"{canceller.erle_db:.1f} dB"),
+            ("partitions", f"{canceller.partitions} x {block} taps")]
+    print_result(f"Echo canceller ( {frame_ms} ms frames, {tail_ms} ms tail )", rows)
+
+
+"""
+Video encode: frames sent per second when 720p frames arrive faster than they can be encoded, single worker vs. the pool
+"""
+def bench_video_encode(frames=120, height=720, width=1280):
+    rng = np.random.default_rng(3)
+    # smooth gradient plus noise, closer to a camera frame's JPEG cost than pure noise
+    gradient = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+    frame = np.clip(gradient + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+
+    rows = []
+    for workers in (1, 4):
+        sent = []
+        pipeline = encodePipeline(lambda frame_id, buffer: sent.append(frame_id), workers=workers)
+        start = time.perf_counter()
+        for _ in range(frames):
+            pipeline.submit(frame)
+            time.sleep(1 / 120)
+        pipeline.close()
+        elapsed = time.perf_counter() - start
+        stats = pipeline.get_stats()
+        rows.append((f"{stats['workers']} encode worker(s)", f"{len(sent) / elapsed:.1f} fps sent, {stats['dropped']} dropped, "
+                                                          f"{stats['encode_ms']:.1f} ms / encode, in order {sent == sorted(sent)}"))
+
+    print_result(f"Video encode ( {width}x{height} JPEG, frames offered at 120 fps )", rows)
+
+
+"""
+Video decode: CPU per received 720p frame for render sizes from full window down to a grid thumbnail
+"""
+def bench_video_decode(frames=50, height=720, width=1280):
+    rng = np.random.default_rng(4)
+    gradient = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+    frame = np.clip(gradient + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    retval, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 40])
+    payload = b"".join(build_video_payload(buffer, width, height))   # contiguous, as the receiver reassembles it
+
+    rows = []
+    decoder = decodeWorker(queue.Queue())
+    for render_width, render_height in ((1280, 720), (640, 360), (320, 180), (160, 90)):
+        decoder.set_render_size(render_width, render_height)
+        start = time.perf_counter()
+        for _ in range(frames):
+            decoded = decoder.decode(payload)
+            decoder.frame_pool.release(decoded)
+        elapsed = (time.perf_counter() - start) / frames
+        rows.append((f"{render_width}x{render_height} tile", f"{elapsed * 1000:.2f} ms / frame, decoded at 1/{decoder.reduction} ( {decoded.shape[1]}x{decoded.shape[0]} )"))
+
+    print_result(f"Video decode ( {width}x{height} JPEG )", rows)
+
+
+"""
+Tile mode: bytes & encode CPU per frame on a talking-head like shot ( static noisy background, a moving head & mouth )
+compared with a full JPEG every frame
+"""
+def bench_tile_video(frames=90, height=720, width=1280):
+    rng = np.random.default_rng(5)
+    background = np.clip(np.linspace(30, 200, width, dtype=np.float32)[None, :, None] + rng.normal(0, 10, (height, width, 3)), 0, 255).astype(np.uint8)
+    shots = []
+    for n in range(frames):
+        frame = background.copy()
+        x = width // 2 + int(40 * np.sin(n / 5))
+        cv2.circle(frame, (x, height // 2), height // 6, (40, 90, 200), -1)
+        cv2.ellipse(frame, (x, height // 2 + height // 12), (50, 10 + int(10 * abs(np.sin(n)))), 0, 0, 360, (0, 0, 0), -1)
+        shots.append(cv2.add(frame, rng.integers(0, 2, (height, width, 3), dtype=np.uint8)))   # sensor noise
+
+    rows = []
+    for label, tiles in (("full JPEG", None), ("changed tiles", tileEncoder())):
+        sent = []
+        done = threading.Event()
+        def send(frame_id, payload):
+            sent.append(payload_size(payload))
+            done.set()
+
+        # one frame at a time, CPU time covers the send thread & the encode worker
+        pipeline = encodePipeline(send, workers=1, tiles=tiles)
+        start = time.process_time()
+        for frame in shots:
+            done.clear()
+            if pipeline.submit(frame) and pipeline.pending:
+                done.wait(1)
+        elapsed = time.process_time() - start
+        pipeline.close()
+        extra = f", {tiles.get_stats()['tiles_sent_percent']:.1f} % of tiles sent" if tiles else ""
+        rows.append((label, f"{sum(sent) / frames / 1024:.1f} KiB / frame, {elapsed / frames * 1000:.2f} ms CPU / frame{extra}"))
+
+    print_result(f"Tile mode ( {width}x{height}, quality 40, talking head )", rows)
+
+
+
+"""
+Simulcast: bytes & encode time per layer of a 720p camera JPEG, & wall time per captured frame with one worker vs. the pool
+"""
+def bench_simulcast(frames=60, height=720, width=1280):
+    rng = np.random.default_rng(6)
+    gradient = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+    frame = np.clip(gradient + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    retval, camera_jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    camera_jpeg = camera_jpeg.reshape(1, -1)
+
+    rows = []
+    for workers in (1, 6):
+        sent = {}
+        done = threading.Event()
+        def send(frame_id, payload, layer):
+            sent.setdefault(layer, []).append(payload_size(payload))
+            if sum(len(sizes) for sizes in sent.values()) % 3 == 0:
+                done.set()
+        encoder = simulcastEncoder(send, quality=40, workers=workers, max_size=(width, height))
+        start = time.perf_counter()
+        for _ in range(frames):
+            done.clear()
+            encoder.submit(camera_jpeg)
+            done.wait(1)
+        elapsed = time.perf_counter() - start
+        encoder.close()
+        rows.append((f"{workers} encode worker(s)", f"{elapsed / frames * 1000:.2f} ms / captured frame for all layers"))
+        if workers == 1:
+            for layer, stats in enumerate(encoder.get_stats()["layers"]):
+                rows.append((f"layer {layer} ( 1/{simulcastEncoder.SCALES[layer]} )", f"{sum(sent[layer]) / len(sent[layer]) / 1024:.1f} KiB / frame, "
+                                                                                     f"{stats['encode_ms']:.2f} ms / encode, {stats['passthrough']} passed through"))
+
+    print_result(f"Simulcast ( {width}x{height} camera JPEG, quality 40 )", rows)
+
+
+
+"""
+Frame pool: memory allocated per frame in steady state by capture ( camera.read into a buffer ), a half size encode
+& a decode resized to the window, with buffers dropped after every frame vs. recycled through the pool
+ - measured with tracemalloc, NumPy & cv2 arrays are traced, the decoded JPEG itself can't be pooled ( imdecode has no dst )
+"""
+def bench_frame_pool(frames=60, height=720, width=1280, window=(800, 450)):
+    rng = np.random.default_rng(7)
+    path = os.path.join(tempfile.mkdtemp(), "bench.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), VIDEO_FPS, (width, height))
+    gradient = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+    for _ in range(8):
+        writer.write(np.clip(gradient + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8))
+    writer.release()
+
+    # bytes allocated by one call, with the peak reset each call a buffer freed inside it still counts
+    def traced(call, *args):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = call(*args)
+        return result, tracemalloc.get_traced_memory()[1] - before
+
+    rows = []
+    for label, max_free in (("no reuse", 0), ("frame pool", 8)):
+        pool = framePool(max_free=max_free)
+        pipeline = encodePipeline(lambda frame_id, payload: None, workers=1, max_size=(width // 2, height // 2), frame_pool=pool)
+        decoder = decodeWorker(queue.Queue(), size=window, frame_pool=pool)
+        camera = cv2.VideoCapture(path)
+        def capture():
+            buffer = pool.acquire((height, width, 3))
+            retval, frame = camera.read(image=buffer)
+            if not retval:
+                camera.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                retval, frame = camera.read(image=buffer)
+            return frame
+
+        allocated = {"capture": 0, "encode": 0, "decode": 0}
+        tracemalloc.start()
+        for n in range(frames):
+            frame, capture_bytes = traced(capture)
+            (payload, duration), encode_bytes = traced(pipeline.encode, frame)
+            payload = b"".join(payload)     # contiguous, as the receiver reassembles it
+            decoded, decode_bytes = traced(decoder.decode, payload)
+            pool.release(decoded)
+            pool.release(frame)
+            if n >= frames // 2:    # steady state, second half only
+                allocated["capture"] += capture_bytes
+                allocated["encode"] += encode_bytes
+                allocated["decode"] += decode_bytes
+        tracemalloc.stop()
+        camera.release()
+        pipeline.close()
+        stats = pool.get_stats()
+        measured = frames - frames // 2
+        per_frame = ", ".join(f"{stage} {total / measured / 1024:.0f}" for stage, total in allocated.items())
+        rows.append((label, f"KiB allocated / frame: {per_frame}, {stats['hit_rate'] * 100:.1f} % reused, pool peak {stats['peak_bytes'] / 2**20:.1f} MiB"))
+
+    os.remove(path)
+    print_result(f"Frame pool ( {width}x{height} capture, {width // 2}x{height // 2} encode, decode to {window[0]}x{window[1]} )", rows)
+
+if __name__ == "__main__":
+    bench_send_path()
+    bench_audio_framing()
+    bench_concealment()
+    bench_resampling()
+    bench_echo_canceller()
+    bench_video_encode()
+    bench_video_decode()
+    bench_tile_video()
+    bench_simulcast()
+    bench_frame_pool()
@@ -14,22 +14,997 @@ import queue
 import sounddevice as sd
 import numpy as np
 import time as t
+import math
+import struct
+
+
+#
+# Codecs
+#
+
+# Audio payload structure: [codec id (1 byte) | channels (1 byte) | frames (2 bytes)] followed by the encoded samples
+AUDIO_FORMAT = 'B B H'
+audio_struct = struct.Struct(AUDIO_FORMAT)
+
+FLOAT32_CODEC = 0
+PCM16_CODEC = 1
+MULAW_CODEC = 2
+ADPCM_CODEC = 3
+COMFORT_NOISE_CODEC = 4     # DTX silence descriptor, one byte of noise level in -dBov, no samples
+
+CODECS = {"float32": FLOAT32_CODEC, "pcm16": PCM16_CODEC, "mulaw": MULAW_CODEC, "adpcm": ADPCM_CODEC}
+
+# G.711 mu-law tables
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+MULAW_EXPONENT = np.array([0] + [int(math.log2(i)) for i in range(1, 256)], dtype=np.int32)     # exponent of ( sample + bias ) >> 7
+
+def build_mulaw_decode_table():
+    code = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (code >> 4) & 0x07
+    magnitude = (((code & 0x0F) << 3) + MULAW_BIAS << exponent) - MULAW_BIAS
+    return np.where(code & 0x80, -magnitude, magnitude).astype(np.int16)
+
+MULAW_DECODE = build_mulaw_decode_table()
+
+# IMA-ADPCM tables
+ADPCM_INDEX = [-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8]
+ADPCM_STEP = [7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+              50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+              253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+              1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+              3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+              12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767]
+ADPCM_STEP_ARRAY = np.array(ADPCM_STEP, dtype=np.int32)
+ADPCM_INDEX_ARRAY = np.array(ADPCM_INDEX, dtype=np.int32)
+adpcm_channel_struct = struct.Struct('h B x')   # per channel: predictor, step index
+
+
+def float_to_pcm16(block):
+    return np.clip(np.rint(block * 32767), -32768, 32767).astype(np.int16)
+
+def mulaw_encode(pcm):
+    samples = pcm.astype(np.int32)
+    sign = (samples < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+    exponent = MULAW_EXPONENT[magnitude >> 7]
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+"""
+IMA-ADPCM encode of one channel
+ - the predictor is recursive, so this is a scalar loop over the samples
+ - each packet starts from its first sample & the carried step index, so packets decode independently
+"""
+def adpcm_encode_channel(samples, index):
+    predictor = samples[0]
+    codes = bytearray(len(samples))     # the first sample is sent as the predictor, its code stays 0
+    for n in range(1, len(samples)):
+        sample = samples[n]
+        step = ADPCM_STEP[index]
+        diff = sample - predictor
+        code = 0
+        if diff < 0:
+            code = 8
+            diff = -diff
+        vpdiff = step >> 3
+        if diff >= step:
+            code |= 4
+            diff -= step
+            vpdiff += step
+        step >>= 1
+        if diff >= step:
+            code |= 2
+            diff -= step
+            vpdiff += step
+        step >>= 1
+        if diff >= step:
+            code |= 1
+            vpdiff += step
+        predictor = predictor - vpdiff if code & 8 else predictor + vpdiff
+        predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+        index += ADPCM_INDEX[code]
+        index = 0 if index < 0 else 88 if index > 88 else index
+        codes[n] = code
+    return codes, index
+
+
+"""
+IMA-ADPCM decode of one channel
+ - only the step index walk is a loop, the differences & the predictor sum are vectorized
+ - if the running sum would clip, the exact scalar decoder is used instead
+"""
+def adpcm_decode_channel(codes, predictor, index):
+    indices = np.empty(len(codes), dtype=np.int32)
+    for n, code in enumerate(codes.tolist()):
+        indices[n] = index
+        index += ADPCM_INDEX[code]
+        index = 0 if index < 0 else 88 if index > 88 else index
+
+    step = ADPCM_STEP_ARRAY[indices]
+    codes = codes.astype(np.int32)
+    vpdiff = (step >> 3) + np.where(codes & 4, step, 0) + np.where(codes & 2, step >> 1, 0) + np.where(codes & 1, step >> 2, 0)
+    samples = predictor + np.cumsum(np.where(codes & 8, -vpdiff, vpdiff))
+    if samples.min(initial=0) >= -32768 and samples.max(initial=0) <= 32767:
+        return samples.astype(np.int16)
+
+    out = np.empty(len(codes), dtype=np.int16)
+    for n, delta in enumerate(np.where(codes & 8, -vpdiff, vpdiff).tolist()):
+        predictor += delta
+        predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+        out[n] = predictor
+    return out
+
+
+"""
+Encodes a float32 block ( frames, channels ) into an audio payload
+ - returned as parts, the sub-header & the encoded samples, so send_data sends them without joining
+ - mono downmixes to one channel before encoding
+ - adpcm_index holds the encoder's step index per channel between packets
+"""
+def encode_audio(block, codec_id, mono=False, adpcm_index=None):
+    if mono and block.shape[1] > 1:
+        block = block.mean(axis=1, keepdims=True)
+    frames, channels = block.shape
+    sub_header = audio_struct.pack(codec_id, channels, frames)
+
+    if codec_id == FLOAT32_CODEC:
+        return [sub_header, np.ascontiguousarray(block, dtype=np.float32)]
+
+    pcm = float_to_pcm16(block)
+    if codec_id == PCM16_CODEC:
+        return [sub_header, pcm.astype('<i2')]
+    if codec_id == MULAW_CODEC:
+        return [sub_header, mulaw_encode(pcm)]
+    if codec_id == ADPCM_CODEC:
+        parts = [sub_header]
+        packed = []
+        for channel in range(channels):
+            samples = pcm[:, channel].tolist()
+            index = adpcm_index[channel] if adpcm_index else 0
+            codes, next_index = adpcm_encode_channel(samples, index)
+            if adpcm_index:
+                adpcm_index[channel] = next_index
+            parts.append(adpcm_channel_struct.pack(samples[0], index))
+            codes = np.frombuffer(codes, dtype=np.uint8)
+            if frames % 2:
+                codes = np.append(codes, 0).astype(np.uint8)
+            packed.append(codes[0::2] | (codes[1::2] << 4))
+        return parts + packed
+    raise ValueError(f"Unknown audio codec {codec_id}")
+
+
+"""
+Silence descriptor sent instead of silent frames, carries the sender's background noise level ( rms )
+"""
+def encode_comfort_noise(level, channels):
+    dbov = min(127, max(0, int(round(-20 * math.log10(max(level, 1e-7))))))
+    return audio_struct.pack(COMFORT_NOISE_CODEC, channels, 0) + bytes((dbov,))
+
+def comfort_noise_level(payload):
+    return 10 ** (-payload[audio_struct.size] / 20)
+
+def is_comfort_noise(payload):
+    return payload[0] == COMFORT_NOISE_CODEC
+
+
+"""
+Decodes an audio payload into a float32 block ( frames, channels )
+"""
+def decode_audio(payload):
+    codec_id, channels, frames = audio_struct.unpack_from(payload, 0)
+    data = payload[audio_struct.size:]
+
+    if codec_id == FLOAT32_CODEC:
+        return np.frombuffer(data, dtype=np.float32, count=frames * channels).reshape(frames, channels)
+    if codec_id == PCM16_CODEC:
+        pcm = np.frombuffer(data, dtype='<i2', count=frames * channels).reshape(frames, channels)
+    elif codec_id == MULAW_CODEC:
+        pcm = MULAW_DECODE[np.frombuffer(data, dtype=np.uint8, count=frames * channels)].reshape(frames, channels)
+    elif codec_id == ADPCM_CODEC:
+        pcm = np.empty((frames, channels), dtype=np.int16)
+        packed_length = (frames + 1) // 2
+        offset = channels * adpcm_channel_struct.size
+        for channel in range(channels):
+            predictor, index = adpcm_channel_struct.unpack_from(data, channel * adpcm_channel_struct.size)
+            packed = np.frombuffer(data, dtype=np.uint8, count=packed_length, offset=offset + channel * packed_length)
+            codes = np.empty(packed_length * 2, dtype=np.uint8)
+            codes[0::2] = packed & 0x0F
+            codes[1::2] = packed >> 4
+            # the first sample is the predictor itself
+            pcm[0, channel] = predictor
+            if frames > 1:
+                pcm[1:, channel] = adpcm_decode_channel(codes[1:frames], predictor, index)
+    else:
+        raise ValueError(f"Unknown audio codec {codec_id}")
+    return pcm.astype(np.float32) / 32768
+
+
+"""
+Jitter buffer for received audio packets
+ - packets are kept by sequence number, so late packets are put back in order
+ - the packet timestamp is the sender's media clock in samples, its spread against the arrival time is the jitter
+ - the target depth ( in packets ) follows the measured jitter, playout only starts once that depth is buffered
+ - running dry after a DTX silence descriptor is the sender being silent, not an underrun
+ - latency above the target is trimmed gradually, one packet per TRIM_READS reads once the excess has lasted that long
+ - counts late, lost, duplicate & overflowed packets and underruns
+
+Used like a queue by the header dispatcher ( put_nowait ) and the audio callback ( get_nowait )
+"""
+class jitterBuffer:
+    TRIM_READS = 8
+
+    def __init__(self, sample_rate=48000, min_depth=2, max_depth=25):
+        self.sample_rate = sample_rate
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.target_depth = min_depth
+
+        self.packets = {}
+        self.next_seq = None
+        self.playing = False
+        self.lock = threading.Lock()
+
+        # RFC 3550 style inter-arrival jitter, in samples
+        self.jitter = 0.0
+        self.last_transit = None
+        self.packet_frames = 0
+        self.silence = False    # last packet played was a DTX silence descriptor
+        self.excess_reads = 0   # reads in a row with more buffered than the target allows
+
+        self.late = 0
+        self.lost = 0
+        self.duplicate = 0
+        self.overflow = 0
+        self.underruns = 0
+
+    """
+    Adds a received packet, late & duplicate packets are released right away
+    """
+    def put_nowait(self, packet):
+        with self.lock:
+            seq = packet.seq_num
+            if self.next_seq is not None and seq < self.next_seq:
+                self.late += 1
+                packet.release()
+                return
+            if seq in self.packets:
+                self.duplicate += 1
+                packet.release()
+                return
+
+            frames = audio_struct.unpack_from(packet.payload, 0)[2] if len(packet.payload) >= audio_struct.size else 0
+            self.update_jitter(packet.timestamp, frames)
+            self.packets[seq] = packet
+
+            if len(self.packets) > self.max_depth:
+                self.overflow += 1
+                self.packets.pop(min(self.packets)).release()
+                self.next_seq = min(self.packets)
+
+    def put(self, packet, block=True, timeout=None):
+        self.put_nowait(packet)
+
+    """
+    Returns the next packet to play
+    raises queue.Empty while buffering, on an underrun and when the next packet is lost
+    """
+    def get_nowait(self):
+        with self.lock:
+            if not self.playing:
+                if len(self.packets) < self.target_depth:
+                    raise queue.Empty
+                self.playing = True
+                oldest = min(self.packets)
+                if self.next_seq is not None and oldest > self.next_seq:
+                    self.lost += oldest - self.next_seq
+                self.next_seq = oldest
+
+            if not self.packets:
+                # nothing left, rebuild the target depth before playing again
+                if not self.silence:
+                    self.underruns += 1
+                self.playing = False
+                raise queue.Empty
+
+            # more buffered than needed ( jitter went down ), skip the oldest to bring latency back down
+            # skipping splices the audio, so only after the excess has lasted TRIM_READS reads ( a burst that
+            # drains by itself is kept ) & at most once per TRIM_READS, a silence descriptor splices nothing & goes right away
+            if len(self.packets) > self.target_depth + 2 and self.next_seq in self.packets:
+                self.excess_reads += 1
+                if self.excess_reads >= self.TRIM_READS or is_comfort_noise(self.packets[self.next_seq].payload):
+                    self.packets.pop(self.next_seq).release()
+                    self.overflow += 1
+                    self.next_seq += 1
+                    self.excess_reads = 0
+            else:
+                self.excess_reads = 0
+
+            packet = self.packets.pop(self.next_seq, None)
+            self.next_seq += 1
+            if packet is None:
+                self.lost += 1
+                raise queue.Empty
+            self.silence = is_comfort_noise(packet.payload)
+            return packet
+
+    """
+    Updates the jitter estimate & the target depth from one arrival
+     - packets are numbered per packet sent, so with DTX the frames per packet come from the payload
+    """
+    def update_jitter(self, timestamp, frames):
+        transit = t.monotonic() * self.sample_rate - timestamp
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+        self.last_transit = transit
+
+        if frames:
+            self.packet_frames = frames
+
+        if self.packet_frames > 0:
+            depth = 1 + math.ceil(3 * self.jitter / self.packet_frames)
+            self.target_depth = min(self.max_depth, max(self.min_depth, depth))
+
+    def qsize(self):
+        return len(self.packets)
+
+    def empty(self):
+        return not self.packets
+
+    # buffering delay in seconds
+    def delay(self):
+        return len(self.packets) * self.packet_frames / self.sample_rate
+
+    def get_stats(self):
+        return {"depth": len(self.packets), "target_depth": self.target_depth, "jitter_ms": self.jitter / self.sample_rate * 1000,
+                "late": self.late, "lost": self.lost, "duplicate": self.duplicate, "overflow": self.overflow, "underruns": self.underruns}
+
+
+"""
+Single producer / single consumer float32 ring buffer sized in frames
+ - the network side writes, the PortAudio callback reads
+ - each side only moves its own position, so no lock is needed
+ - reads always fill the whole output block, missing frames are zeros ( underrun )
+ - writes that don't fit are cut short ( overrun )
+"""
+class audioRing:
+    def __init__(self, capacity_frames=48000, channels=2):
+        self.capacity = capacity_frames
+        self.channels = channels
+        self.buffer = np.zeros((capacity_frames, channels), dtype=np.float32)
+        self.write_pos = 0
+        self.read_pos = 0
+
+        self.underruns = 0
+        self.overruns = 0
+
+    def available(self):
+        return self.write_pos - self.read_pos
+
+    def space(self):
+        return self.capacity - self.available()
+
+    def write(self, data):
+        count = len(data)
+        space = self.space()
+        if count > space:
+            self.overruns += 1
+            count = space
+
+        start = self.write_pos % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = data[:first]
+        self.buffer[:count - first] = data[first:count]
+        self.write_pos += count
+        return count
+
+    # drops count frames without reading them ( consumer side )
+    def skip(self, count):
+        self.read_pos += min(count, self.available())
+
+    def read_into(self, out):
+        frames = len(out)
+        count = min(frames, self.available())
+
+        start = self.read_pos % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:count] = self.buffer[:count - first]
+        if count < frames:
+            out[count:] = 0
+            self.underruns += 1
+        self.read_pos += count
+        return count
+
+
+"""
+Packet loss concealment for the playout callback
+ - short gaps repeat the last pitch period of good audio with a decaying gain ( found once per gap by FFT autocorrelation )
+ - past fade_ms the repetition crossfades into comfort noise ( or silence when noise_level is 0 )
+ - when real audio resumes it is crossfaded in from the concealment over resume_ms
+ - all work is vectorized into preallocated scratch buffers, nothing is allocated per callback, the pitch search included
+"""
+class lossConcealer:
+    def __init__(self, frame_frames=960, channels=2, sample_rate=48000, decay_ms=20, fade_ms=60, resume_ms=2.5, max_frames=8192):
+        # pitch periods between 2.5 & 15 ms, the history holds two of the longest
+        self.min_period = sample_rate // 400
+        self.max_period = sample_rate * 15 // 1000
+        self.history_frames = max(frame_frames, 2 * self.max_period)
+        self.history = np.zeros((self.history_frames, channels), dtype=np.float32)
+        self.spare_history = np.zeros((self.history_frames, channels), dtype=np.float32)
+        self.period = self.max_period
+        self.phase = 0
+        self.concealed = 0          # samples concealed in the current gap
+        self.decay = sample_rate * decay_ms / 1000
+        self.fade = int(sample_rate * fade_ms / 1000)
+        self.resume = int(sample_rate * resume_ms / 1000)
+        self.noise_level = 0.0      # rms of the comfort noise used in long gaps
+
+        self.ramp = np.arange(max_frames, dtype=np.float32)
+        self.gain = np.empty(max_frames, dtype=np.float32)
+        self.noise_gain = np.empty(max_frames, dtype=np.float32)
+        self.repeat_gain = np.empty(max_frames, dtype=np.float32)
+        self.scratch = np.empty((max_frames, channels), dtype=np.float32)
+
+        # find_period's buffers, the history is zero padded to twice its length so the correlation doesn't wrap
+        self.mono_sum = np.empty(self.history_frames, dtype=np.float32)
+        self.mono = np.zeros(2 * self.history_frames, dtype=np.float64)
+        self.spectrum = np.empty(self.history_frames + 1, dtype=np.complex128)
+        self.power = np.empty(self.history_frames + 1, dtype=np.float64)
+        self.correlation = np.empty(2 * self.history_frames, dtype=np.float64)
+        self.energy = np.empty(self.history_frames, dtype=np.float64)
+        self.tail = np.empty((max(self.resume, 1), channels), dtype=np.float32)
+        self.noise = np.random.default_rng().standard_normal((sample_rate, channels)).astype(np.float32)
+        self.noise_phase = 0
+
+        self.concealed_frames = 0
+        self.gaps = 0
+
+    """
+    Called with the output block and how many frames of it hold real audio
+    """
+    def process(self, out, count):
+        if count:
+            if self.concealed:
+                self.crossfade_in(out[:count])
+            self.remember(out[:count])
+        if count < len(out):
+            self.conceal(out[count:])
+
+    """
+    Fills out with the concealment of the current gap
+    """
+    def conceal(self, out):
+        frames = len(out)
+        if not self.concealed:
+            self.gaps += 1
+            self.period = self.find_period()
+            self.phase = 0
+        self.concealed_frames += frames
+
+        # repeat the last pitch period
+        source = self.history[self.history_frames - self.period:]
+        filled = 0
+        while filled < frames:
+            length = min(frames - filled, self.period - self.phase)
+            out[filled:filled + length] = source[self.phase:self.phase + length]
+            self.phase = (self.phase + length) % self.period
+            filled += length
+
+        # gain: exponential decay, reaching zero at fade while the comfort noise comes up
+        position = self.ramp[:frames]
+        gain = self.gain[:frames]
+        np.add(position, self.concealed, out=gain)
+        noise_gain = self.noise_gain[:frames]
+        np.multiply(gain, 1 / self.fade, out=noise_gain)
+        np.clip(noise_gain, 0, 1, out=noise_gain)
+        np.multiply(gain, -1 / self.decay, out=gain)
+        np.exp(gain, out=gain)
+        repeat_gain = self.repeat_gain[:frames]
+        np.subtract(1, noise_gain, out=repeat_gain)
+        np.multiply(gain, repeat_gain, out=gain)
+        self.scale(out, gain)
+
+        if self.noise_level:
+            self.add_noise(out, noise_gain)
+        self.concealed += frames
+
+    def add_noise(self, out, gain):
+        frames = len(out)
+        scratch = self.scratch[:frames]
+        filled = 0
+        while filled < frames:
+            length = min(frames - filled, len(self.noise) - self.noise_phase)
+            scratch[filled:filled + length] = self.noise[self.noise_phase:self.noise_phase + length]
+            self.noise_phase = (self.noise_phase + length) % len(self.noise)
+            filled += length
+        self.scale(scratch, gain)
+        scratch *= self.noise_level
+        out += scratch
+
+    # multiplies every channel by a per frame gain, one channel at a time since broadcasting a ( frames, 1 ) gain buffers
+    def scale(self, block, gain):
+        for channel in range(block.shape[1]):
+            np.multiply(block[:, channel], gain, out=block[:, channel])
+
+    """
+    Crossfades the start of real audio from the continuing concealment, then ends the gap
+    """
+    def crossfade_in(self, out):
+        frames = min(len(out), self.resume)
+        if frames:
+            tail = self.tail[:frames]
+            gaps, concealed_frames = self.gaps, self.concealed_frames
+            self.conceal(tail)
+            self.gaps, self.concealed_frames = gaps, concealed_frames
+
+            fade_in = self.gain[:frames]
+            np.multiply(self.ramp[:frames], 1 / frames, out=fade_in)
+            self.scale(out[:frames], fade_in)
+            np.subtract(1, fade_in, out=fade_in)
+            self.scale(tail, fade_in)
+            out[:frames] += tail
+        self.concealed = 0
+
+    """
+    Pitch period of the history, the lag with the highest normalized autocorrelation
+     - runs at the start of a gap inside the playout callback, so every step writes into the preallocated buffers
+    """
+    def find_period(self):
+        frames = self.history_frames
+        # the channel sum, scale doesn't change the best lag, added up in float32 since mixed dtypes buffer
+        np.copyto(self.mono_sum, self.history[:, 0])
+        for channel in range(1, self.history.shape[1]):
+            np.add(self.mono_sum, self.history[:, channel], out=self.mono_sum)
+        mono = self.mono[:frames]
+        np.copyto(mono, self.mono_sum)
+        np.fft.rfft(self.mono, out=self.spectrum)
+        np.abs(self.spectrum, out=self.power)
+        np.square(self.power, out=self.power)
+        np.copyto(self.spectrum, self.power)
+        np.fft.irfft(self.spectrum, 2 * frames, out=self.correlation)
+        correlation = self.correlation[self.min_period:self.max_period + 1]
+        if correlation[0] <= 0 and correlation.max() <= 0:
+            return self.max_period
+
+        # energy[ frames - 1 - lag ] is the energy of mono[ lag: ]
+        energy = self.energy
+        np.square(mono[::-1], out=energy)
+        np.cumsum(energy, out=energy)
+        lag_energy = energy[frames - 1 - self.max_period:frames - self.min_period][::-1]
+        np.sqrt(lag_energy, out=lag_energy)
+        lag_energy += 1e-9
+        np.divide(correlation, lag_energy, out=correlation)
+        return self.min_period + int(np.argmax(correlation))
+
+    """
+    Keeps the most recent history_frames of real audio for repetition
+     - shifting in place would overlap & make numpy copy, so the shift goes into the spare history & the two swap
+    """
+    def remember(self, block):
+        frames = len(block)
+        if frames >= self.history_frames:
+            self.history[:] = block[frames - self.history_frames:]
+        else:
+            self.spare_history[:-frames] = self.history[frames:]
+            self.spare_history[-frames:] = block
+            self.history, self.spare_history = self.spare_history, self.history
+
+    def get_stats(self):
+        return {"gaps": self.gaps, "concealed_frames": self.concealed_frames}
+
+
+"""
+Energy / zero-crossing voice activity detector, one decision per frame
+ - the noise floor follows the frame energy down quickly and up slowly
+ - voiced frames stand threshold_db above the floor, unvoiced ( fricatives ) are quieter but cross zero often
+ - a hangover keeps sending for a while after speech, so word endings aren't clipped
+ - noise_level is the rms of recent non-speech frames, sent in DTX silence descriptors
+"""
+class voiceDetector:
+    def __init__(self, frame_duration=20, threshold_db=9, hangover_ms=200, min_level_db=-70):
+        self.threshold_db = threshold_db
+        self.min_level_db = min_level_db
+        self.hangover_frames = max(1, hangover_ms // frame_duration)
+        self.rise_db = 0.5 * frame_duration / 1000     # floor rises at most 0.5 dB per second
+
+        self.noise_floor = None
+        self.noise_level = 0.0
+        self.hangover = 0
+
+        self.speech_frames = 0
+        self.silent_frames = 0
+
+    def is_speech(self, frame):
+        mono = frame.mean(axis=1) if frame.ndim > 1 else frame
+        energy = float(np.dot(mono, mono)) / len(mono)
+        level_db = 10 * math.log10(energy + 1e-12)
+        crossings = np.count_nonzero(np.signbit(mono[1:]) != np.signbit(mono[:-1])) / len(mono)
+
+        if self.noise_floor is None or level_db < self.noise_floor:
+            self.noise_floor = level_db
+        else:
+            self.noise_floor += self.rise_db
+
+        above = level_db - self.noise_floor
+        speech = level_db > self.min_level_db and (above > self.threshold_db or (above > self.threshold_db / 2 and crossings > 0.2))
+
+        if speech:
+            self.hangover = self.hangover_frames
+        elif self.hangover:
+            self.hangover -= 1
+            speech = True
+        else:
+            level = math.sqrt(float(np.vdot(frame, frame)) / frame.size)
+            self.noise_level += (level - self.noise_level) / 8
+
+        if speech:
+            self.speech_frames += 1
+        else:
+            self.silent_frames += 1
+        return speech
+
+
+#
+# Resampling
+#
+
+# every peer sends & receives audio at this rate, devices run at their own rate and are resampled to it
+WIRE_RATE = 48000
+
+# polyphase filter banks by ( up, down ) factor pair, built once per rate pair
+resample_filters = {}
+
+"""
+Polyphase filter bank for resampling by up / down
+ - Kaiser windowed sinc low pass at 0.9 of the lower Nyquist, taps_per_phase taps for each of the up phases
+"""
+def resample_filter(up, down, taps_per_phase=32):
+    key = (up, down, taps_per_phase)
+    bank = resample_filters.get(key)
+    if bank is None:
+        length = up * taps_per_phase
+        cutoff = 0.5 / max(up, down) * 0.9
+        n = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, 8.0) * up
+        # bank[phase, k] multiplies the input sample k steps back from the output position
+        bank = np.ascontiguousarray(prototype.reshape(taps_per_phase, up).T, dtype=np.float32)
+        resample_filters[key] = bank
+    return bank
+
+
+"""
+Streaming polyphase resampler between two sample rates
+ - output sample n sits at n * down / up input samples, it is the filter phase of that position applied to the inputs before it
+ - each block is handled in one vectorized gather & product, the last taps of input are kept for the next block
+"""
+class polyphaseResampler:
+    def __init__(self, in_rate, out_rate, channels=2, taps_per_phase=32):
+        divisor = math.gcd(int(in_rate), int(out_rate))
+        self.up = int(out_rate) // divisor
+        self.down = int(in_rate) // divisor
+        self.bank = resample_filter(self.up, self.down, taps_per_phase)
+        self.taps = taps_per_phase
+        self.history = np.zeros((taps_per_phase - 1, channels), dtype=np.float32)
+        self.position = 0       # next output position, in 1 / up input samples from the start of the next block
+
+    def process(self, block):
+        frames = len(block)
+        total = frames * self.up
+        count = max(0, -(-(total - self.position) // self.down))
+
+        data = np.concatenate((self.history, block.astype(np.float32, copy=False)))
+        positions = self.position + self.down * np.arange(count)
+        base = positions // self.up + self.taps - 1
+        phase = positions % self.up
+
+        # windows[n, k] = data[base[n] - k]
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.taps, axis=0)[base - self.taps + 1][:, :, ::-1]
+        out = np.einsum('nk,nck->nc', self.bank[phase], windows)
+
+        self.position += count * self.down - total
+        self.history = data[len(data) - self.taps + 1:].copy()
+        return out.astype(np.float32, copy=False)
+
+
+"""
+Native sample rate of a device, the wire rate when it can't be queried
+"""
+def device_rate(device, kind):
+    try:
+        return int(sd.query_devices(device, kind)['default_samplerate'])
+    except Exception:
+        return WIRE_RATE
+
+
+"""
+Volume slider ( 0 - 100 ) to linear gain, squared so the slider follows loudness more closely
+"""
+def volume_to_gain(volume):
+    return (max(0, volume) / 100) ** 2
+
+
+"""
+In place gain stage for the audio callbacks
+ - gain changes ramp over ramp_frames samples instead of jumping, so there is no zipper noise
+ - a soft limiter bends samples above knee towards full scale instead of clipping them
+ - rms & peak of every processed block are kept for the level meters
+ - works in preallocated scratch buffers, nothing is allocated per block
+"""
+class gainStage:
+    def __init__(self, volume=100, channels=2, ramp_frames=480, knee=0.8, max_frames=8192):
+        self.gain = volume_to_gain(volume)
+        self.target = self.gain
+        self.ramp_frames = ramp_frames
+        self.knee = knee
+
+        self.index = np.arange(1, max_frames + 1, dtype=np.float32)
+        self.gains = np.empty(max_frames, dtype=np.float32)
+        self.scratch = np.empty((max_frames, channels), dtype=np.float32)
+        self.clipped = np.empty((max_frames, channels), dtype=np.float32)
+
+        self.rms = 0.0
+        self.peak = 0.0
+        self.limited_blocks = 0
+
+    # safe to call from any thread, the next block ramps to it
+    def set_volume(self, volume):
+        self.target = volume_to_gain(volume)
+
+    def process(self, block):
+        frames = len(block)
+        target = self.target
+        if self.gain != target:
+            gains = self.gains[:frames]
+            np.multiply(self.index[:frames], (target - self.gain) / self.ramp_frames if self.ramp_frames else target - self.gain, out=gains)
+            gains += self.gain
+            if target > self.gain:
+                np.minimum(gains, target, out=gains)
+            else:
+                np.maximum(gains, target, out=gains)
+            # one channel at a time, broadcasting a ( frames, 1 ) gain would allocate
+            for channel in range(block.shape[1]):
+                np.multiply(block[:, channel], gains, out=block[:, channel])
+            self.gain = float(gains[-1])
+        elif target != 1:
+            block *= target
+
+        magnitude = self.scratch[:frames]
+        np.abs(block, out=magnitude)
+        self.peak = float(magnitude.max(initial=0))
+        if self.peak > self.knee:
+            self.limit(block, magnitude)
+            self.peak = float(np.abs(block, out=magnitude).max())
+        self.rms = math.sqrt(float(np.vdot(block, block)) / block.size) if block.size else 0.0
+
+    # |y| = min( |x|, knee ) + ( 1 - knee ) * tanh( ( |x| - knee ) / ( 1 - knee ) ) above the knee
+    def limit(self, block, magnitude):
+        headroom = 1 - self.knee
+        clipped = self.clipped[:len(block)]
+        np.clip(block, -self.knee, self.knee, out=clipped)
+        np.subtract(magnitude, self.knee, out=magnitude)
+        np.maximum(magnitude, 0, out=magnitude)
+        np.multiply(magnitude, 1 / headroom, out=magnitude)
+        np.tanh(magnitude, out=magnitude)
+        np.multiply(magnitude, headroom, out=magnitude)
+        np.copysign(magnitude, block, out=magnitude)
+        np.add(clipped, magnitude, out=block)
+        self.limited_blocks += 1
+
+    def get_levels(self):
+        return {"rms_db": 20 * math.log10(self.rms + 1e-9), "peak_db": 20 * math.log10(self.peak + 1e-9), "limited_blocks": self.limited_blocks}
+
+
+"""
+Acoustic echo canceller, partitioned block frequency domain adaptive filter ( overlap-save, NLMS step )
+ - the far-end reference is what the output callback played, the near-end is the captured frame
+ - the echo path is modeled over tail_ms, split into partitions of one frame each
+ - the estimate is made on the mono mix and taken off every channel
+ - adaptation freezes while the near-end talks over the far-end ( Geigel double-talk detector )
+ - the filter is left unconstrained except for one partition per frame, which keeps the cost to a few FFTs per frame
+"""
+class echoCanceller:
+    def __init__(self, frame_frames=960, sample_rate=48000, tail_ms=80, step=0.5, double_talk=0.5):
+        self.block = frame_frames
+        self.partitions = max(1, -(-(sample_rate * tail_ms // 1000) // frame_frames))
+        self.step = step
+        self.double_talk = double_talk
+        bins = frame_frames + 1
+
+        self.weights = np.zeros((self.partitions, bins), dtype=np.complex64)
+        self.far_spectra = np.zeros((self.partitions, bins), dtype=np.complex64)
+        self.far_power = np.full(bins, 1e-6, dtype=np.float32)
+        self.far_frames = np.zeros(2 * frame_frames, dtype=np.float32)      # previous & current far-end frame
+        self.error_frames = np.zeros(2 * frame_frames, dtype=np.float32)    # zeros & current error
+        self.far_peaks = np.zeros(self.partitions, dtype=np.float32)
+        self.constrain_next = 0
+
+        self.frames = 0
+        self.double_talk_frames = 0
+        self.erle_db = 0.0
+
+    """
+    Takes the echo of far ( frames, channels ) out of near ( frames, channels ) in place
+    """
+    def process(self, near, far):
+        block = self.block
+        near_mono = near.mean(axis=1)
+        far_mono = far.mean(axis=1) if far.shape[1] > 1 else far[:, 0]
+
+        # newest far-end spectrum goes in front
+        self.far_frames[:block] = self.far_frames[block:]
+        self.far_frames[block:] = far_mono
+        self.far_spectra[1:] = self.far_spectra[:-1]
+        self.far_spectra[0] = np.fft.rfft(self.far_frames)
+        self.far_peaks[1:] = self.far_peaks[:-1]
+        self.far_peaks[0] = np.abs(far_mono).max(initial=0)
+
+        estimate = np.fft.irfft((self.weights * self.far_spectra).sum(axis=0))[block:].astype(np.float32)
+        error = near_mono - estimate
+        near -= estimate[:, None]
+
+        near_energy = float(np.dot(near_mono, near_mono))
+        error_energy = float(np.dot(error, error))
+        if near_energy > 0:
+            self.erle_db += (10 * math.log10((near_energy + 1e-12) / (error_energy + 1e-12)) - self.erle_db) / 16
+        self.frames += 1
+
+        if np.abs(near_mono).max(initial=0) > self.double_talk * self.far_peaks.max() and self.far_peaks.max() > 0:
+            self.double_talk_frames += 1
+            return
+
+        # normalized step from the smoothed far-end power of every bin
+        power = self.far_spectra[0].real ** 2 + self.far_spectra[0].imag ** 2
+        self.far_power += (power - self.far_power) * 0.1
+        self.error_frames[block:] = error
+        gradient = np.fft.rfft(self.error_frames) * (self.step / (self.far_power * self.partitions + 1e-6))
+        self.weights += np.conj(self.far_spectra) * gradient
+
+        # keep one partition a true linear convolution per frame
+        partition = self.constrain_next
+        taps = np.fft.irfft(self.weights[partition])
+        taps[block:] = 0
+        self.weights[partition] = np.fft.rfft(taps)
+        self.constrain_next = (partition + 1) % self.partitions
+
+    def reset(self):
+        self.weights[:] = 0
+        self.far_spectra[:] = 0
+
+    def get_stats(self):
+        return {"erle_db": self.erle_db, "partitions": self.partitions, "double_talk_frames": self.double_talk_frames}
+
+
+"""
+Timing of an audio callback, only recorded while enabled
+ - durations go into power of two microsecond bins, callbacks longer than their block lasts miss the deadline
+ - PortAudio status flags ( over / underflow ) are counted instead of printed
+"""
+class callbackMonitor:
+    BINS = 21   # up to ~1 s
+
+    def __init__(self, sample_rate, enabled=False):
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        self.histogram = [0] * self.BINS
+        self.calls = 0
+        self.deadline_misses = 0
+        self.longest = 0.0
+        self.status_count = 0
+        self.last_status = None
+
+    def status(self, status):
+        self.status_count += 1
+        self.last_status = status
+
+    def record(self, start, frames):
+        duration = t.perf_counter() - start
+        microseconds = int(duration * 1e6)
+        self.histogram[min(self.BINS - 1, microseconds.bit_length())] += 1
+        self.calls += 1
+        if duration > frames / self.sample_rate:
+            self.deadline_misses += 1
+        if duration > self.longest:
+            self.longest = duration
+
+    def get_stats(self):
+        histogram = {f"< {1 << n} us": count for n, count in enumerate(self.histogram) if count}
+        return {"calls": self.calls, "deadline_misses": self.deadline_misses, "longest_ms": self.longest * 1000,
+                "histogram": histogram, "status_count": self.status_count, "last_status": str(self.last_status) if self.last_status else None}
+
+
+# packet lengths in milliseconds the capture stream can be framed at
+FRAME_DURATIONS = (5, 10, 20, 40)
+
 
 class audioConnect:
-    def __init__(self, inputVolume=100, outputVolume=100, inputIndex=0, outputIndex=1):
+    # audio of the call in progress, lets the UI change volume & read levels mid-call
+    active = None
+
+    def __init__(self, inputVolume=100, outputVolume=100, inputIndex=0, outputIndex=1, codec="pcm16", mono=False, frame_duration=20, dtx=True, echo_cancel=True, instrument=False):
         self.headerClass = header()
 
-        sd.default.samplerate = 48000
         sd.default.channels = 2
         sd.default.dtype = np.float32
         sd.default.device = (inputIndex, outputIndex)
 
         self.output_volume = outputVolume
+        self.input_volume = inputVolume
 
         self.inputDevice = sd.default.device[0]
         self.outputDevice = sd.default.device[1]
 
-        self.audio_queue = queue.Queue()
+        # devices run at their native rate, audio is resampled to & from the wire rate when they differ
+        self.wire_rate = WIRE_RATE
+        self.input_rate = device_rate(self.inputDevice, "input")
+        self.output_rate = device_rate(self.outputDevice, "output")
+        self.capture_resampler = None
+        self.playout_resampler = None
+        if self.input_rate != self.wire_rate:
+            self.capture_resampler = polyphaseResampler(self.input_rate, self.wire_rate, channels=sd.default.channels)
+        if self.output_rate != self.wire_rate:
+            self.playout_resampler = polyphaseResampler(self.wire_rate, self.output_rate, channels=sd.default.channels)
+
+        # fixed frame duration, used as the block size of both streams and as the packet size
+        if frame_duration not in FRAME_DURATIONS:
+            raise ValueError(f"Audio frame duration must be one of {FRAME_DURATIONS} ms, not {frame_duration}")
+        self.frame_duration = frame_duration
+        self.frame_frames = self.wire_rate * frame_duration // 1000
+        self.input_blocksize = self.input_rate * frame_duration // 1000
+        self.output_blocksize = self.output_rate * frame_duration // 1000
+
+        # filled by the socket's header dispatcher, reorders packets & keeps latency bounded
+        self.audio_queue = jitterBuffer(sample_rate=self.wire_rate)
+
+        # playout ring ( at the output device rate ), filled from the jitter buffer and read by the output callback
+        self.playout_ring = audioRing(capacity_frames=self.output_rate, channels=sd.default.channels)
+        self.playout_frames = self.output_blocksize
+        self.ring_read = threading.Event()
+        self.concealer = lossConcealer(frame_frames=self.output_blocksize, channels=sd.default.channels, sample_rate=self.output_rate)
+
+        # volume of both directions, changed mid-call through set_volume_level / set_input_volume_level
+        self.input_gain = gainStage(volume=inputVolume, channels=sd.default.channels, ramp_frames=self.frame_frames)
+        self.output_gain = gainStage(volume=outputVolume, channels=sd.default.channels, ramp_frames=self.output_blocksize)
+
+        # wire format of sent audio, the codec id travels in each packet so the receiver decodes any codec
+        self.codec_id = CODECS[codec]
+        self.mono = mono
+        self.adpcm_index = [0] * sd.default.channels
+
+        # discontinuous transmission: silent frames aren't sent, a silence descriptor goes out every sid_interval frames instead
+        self.dtx = dtx
+        self.vad = voiceDetector(frame_duration=frame_duration)
+        self.sid_interval = max(1, 200 // frame_duration)
+        self.frames_since_sid = None
+
+        # echo cancelling: the output callback taps what it plays, the capture side reads it back frame by frame
+        self.echo_cancel = echo_cancel
+        self.canceller = echoCanceller(frame_frames=self.frame_frames, sample_rate=self.wire_rate)
+        self.echo_tap = audioRing(capacity_frames=self.output_rate, channels=sd.default.channels)
+        self.echo_wire = audioRing(capacity_frames=self.wire_rate, channels=sd.default.channels)
+        self.echo_frame = np.zeros((self.frame_frames, sd.default.channels), dtype=np.float32)
+        self.echo_max_lag = 2 * self.frame_frames
+        self.echo_resampler = None
+        if self.output_rate != self.wire_rate:
+            self.echo_resampler = polyphaseResampler(self.output_rate, self.wire_rate, channels=sd.default.channels)
+
+        # the input callback only copies into input_ring, the mic thread takes it from there
+        self.input_ring = audioRing(capacity_frames=self.input_rate, channels=sd.default.channels)
+        self.input_block = np.zeros((self.input_rate, sd.default.channels), dtype=np.float32)
+        self.input_ready = threading.Event()
+
+        # callback timing, see set_instrumentation
+        self.input_monitor = callbackMonitor(self.input_rate, enabled=instrument)
+        self.output_monitor = callbackMonitor(self.output_rate, enabled=instrument)
+
+        # captured samples are gathered here until a whole frame can be sent
+        self.capture_ring = audioRing(capacity_frames=self.wire_rate, channels=sd.default.channels)
+        self.capture_frame = np.zeros((self.frame_frames, sd.default.channels), dtype=np.float32)
+
+        # sequence number & media clock ( in samples ) of sent packets
+        self.send_seq = 0
+        self.media_clock = 0
 
         self.sending = True
         self.mute = False
@@ -37,22 +1012,29 @@ class audioConnect:
     
     """
     Uses socket to send data
-     - Runs by using InputStream to have a callback that sends data through header
+     - Runs by using InputStream to have a callback that only copies the samples into input_ring
+     - this thread packetizes & sends whatever the callback left in the ring
+     - the stream asks for frame sized blocks, packets are still cut by packetize in case the host API ignores it
     """
     def stream_audio(self, socket, client_address):
-        # turns users audio input data, then sends input via header
+        # copies users audio input data into the ring, no allocation, no syscalls, no prints
         def input_audio_callback(indata, frames, time, status):
+            monitor = self.input_monitor
+            start = t.perf_counter() if monitor.enabled else 0
             if status:
-                print(f"stream_audio status: {status}")
-                pass
-            audioData = indata.tobytes()
-            self.headerClass.send_data(socket=socket, addr=client_address, data_type=0, seq_num=0, data_send=audioData, timestamp=int(t.time()))
+                monitor.status(status)
+            self.input_ring.write(indata)
+            self.input_ready.set()
+            if monitor.enabled:
+                monitor.record(start, frames)
 
-        with sd.InputStream(callback=input_audio_callback, device=self.inputDevice) as in_stream:
+        with sd.InputStream(callback=input_audio_callback, device=self.inputDevice, samplerate=self.input_rate, blocksize=self.input_blocksize) as in_stream:
             try:
                 in_stream.start()
                 while self.sending and not self.mute:
-                    t.sleep(0.2)
+                    self.input_ready.wait(self.frame_duration / 1000)
+                    self.input_ready.clear()
+                    self.drain_input(socket, client_address)
             except KeyboardInterrupt:
                 print("Stopped stream_audio...")
             finally:
@@ -61,45 +1043,101 @@ class audioConnect:
 
 
     """
-    Uses Socket to receive audio
+    Packetizes everything the input callback has put in input_ring
+    """
+    def drain_input(self, socket, client_address):
+        available = self.input_ring.available()
+        while available:
+            count = min(available, len(self.input_block))
+            block = self.input_block[:count]
+            self.input_ring.read_into(block)
+            self.packetize(block, socket, client_address)
+            available -= count
+
+
+    """
+    Gathers captured samples and sends every whole frame as one packet
+     - packet size only depends on frame_duration, not on the device's callback size or rate
+     - with DTX, silent frames are replaced by a silence descriptor every sid_interval frames
+     - the sequence number counts sent packets, the media clock keeps running through silence
+    """
+    def packetize(self, indata, socket, client_address):
+        if self.capture_resampler is not None:
+            indata = self.capture_resampler.process(indata)
+        self.capture_ring.write(indata)
+        while self.capture_ring.available() >= self.frame_frames:
+            self.capture_ring.read_into(self.capture_frame)
+            if self.echo_cancel:
+                self.read_echo_reference()
+                self.canceller.process(self.capture_frame, self.echo_frame)
+            self.input_gain.process(self.capture_frame)
+
+            audioData = None
+            if not self.dtx or self.vad.is_speech(self.capture_frame):
+                audioData = encode_audio(self.capture_frame, self.codec_id, mono=self.mono, adpcm_index=self.adpcm_index)
+                self.frames_since_sid = None
+            elif self.frames_since_sid is None or self.frames_since_sid >= self.sid_interval:
+                audioData = encode_comfort_noise(self.vad.noise_level, 1 if self.mono else self.capture_ring.channels)
+                self.frames_since_sid = 0
+
+            if self.frames_since_sid is not None:
+                self.frames_since_sid += 1
+            if audioData is not None:
+                self.headerClass.send_data(socket=socket, addr=client_address, data_type=0, seq_num=self.send_seq, data_send=audioData, timestamp=self.media_clock)
+                self.send_seq = (self.send_seq + 1) & 0xFFFFFFFF
+            self.media_clock += self.frame_frames
+
+
+    """
+    Fills echo_frame with the next frame of played audio at the wire rate
+     - reference older than echo_max_lag is skipped, so it stays within the canceller's tail of the echo
+    """
+    def read_echo_reference(self):
+        reference = self.echo_tap
+        if self.echo_resampler is not None:
+            available = self.echo_tap.available()
+            if available:
+                played = np.empty((available, self.echo_tap.channels), dtype=np.float32)
+                self.echo_tap.read_into(played)
+                self.echo_wire.write(self.echo_resampler.process(played))
+            reference = self.echo_wire
+
+        excess = reference.available() - self.echo_max_lag
+        if excess > 0:
+            reference.skip(excess)
+        reference.read_into(self.echo_frame)
+
+
+    """
+    Plays received audio
      - OutputStream proccess the data through a callback
+     - packets are put in audio_queue by the socket's header dispatcher, this never reads the socket
     """
     def play_audio(self, socket):
-        # gets audio from header then places it into a queue to be played
+        # only copies the ring into outdata, exactly frames samples & no allocation
+        # frames the ring couldn't provide are concealed
         def out_audio_callback(outdata, frames, time, status):
+            monitor = self.output_monitor
+            start = t.perf_counter() if monitor.enabled else 0
             if status:
-                print(f"play_audio status: {status}")
-                pass
-            try:
-                outputData = self.audio_queue.get_nowait()
-                outputData = outputData.reshape(-1, sd.default.channels)
-
-                if outputData is None:
-                    # no data is received, nothing is outputed
-                    outdata[:] = 0
-                elif len( outputData ) < len( outdata ):
-                    # the received data is insufficient, fill the rest with zeros
-                    new_len = len( outputData )
-                    outdata[:new_len ] = outputData[:len(outputData) ] 
-                    outdata[ new_len:] = outputData[ len(outputData):]
-                else:
-                    # the correct ammount of data is received
-                    min_len = min(len(outputData), len(outdata))
-                    outdata[ :min_len] = outputData[ :min_len]
-                    outdata[min_len: ] = outputData[min_len: ]
-            except queue.Empty:
-                print("Audio buffer is empty")
-                pass
-            except Exception as E:
-                print(f"Audio Callback error : {E}")
-                pass
+                monitor.status(status)
+            count = self.playout_ring.read_into(outdata)
+            self.concealer.process(outdata, count)
+            self.output_gain.process(outdata)
+            if self.echo_cancel:
+                self.echo_tap.write(outdata)
+            self.playout_frames = frames
+            self.ring_read.set()
+            if monitor.enabled:
+                monitor.record(start, frames)
 
-        with sd.OutputStream(callback=out_audio_callback, device=self.outputDevice) as out_stream:
+        with sd.OutputStream(callback=out_audio_callback, device=self.outputDevice, samplerate=self.output_rate, blocksize=self.output_blocksize) as out_stream:
             try:
                 out_stream.start()
                 while self.sending:
-                    self.headerClass.receive_data(socket=socket)
-                    
+                    self.fill_playout_ring()
+                    self.ring_read.wait(0.005)
+                    self.ring_read.clear()
             except KeyboardInterrupt:
                 print("Stopped play_audio...")
             finally:
@@ -107,12 +1145,40 @@ class audioConnect:
                     out_stream.stop()
 
 
+    """
+    Moves packets from the jitter buffer into the playout ring
+     - keeps about two device blocks buffered, so packets leave the jitter buffer at playout pace
+     - packet payload is a view into a pooled receive buffer, released once decoded into the ring
+    """
+    def fill_playout_ring(self):
+        while self.playout_ring.available() < 2 * self.playout_frames:
+            try:
+                packet = self.audio_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if is_comfort_noise(packet.payload):
+                    # sender went silent, the concealer fades into noise at the sender's level
+                    self.concealer.noise_level = comfort_noise_level(packet.payload)
+                    continue
+                # mono packets are spread over every output channel by the ring write
+                block = decode_audio(packet.payload)
+                if self.playout_resampler is not None:
+                    if block.shape[1] != self.playout_ring.channels:
+                        block = np.repeat(block, self.playout_ring.channels, axis=1)
+                    block = self.playout_resampler.process(block)
+                self.playout_ring.write(block)
+            except Exception as E:
+                print(f"fill_playout_ring error: {E}")
+            finally:
+                packet.release()
+
+
     """
     Starts threads for audio sending & receiving 
     """
     def network_audio(self, socket, client_address):
-        self.headerClass.set_audio_queue(audio_queue=self.audio_queue)
-
+        audioConnect.active = self
         send_thread = threading.Thread(target=self.stream_audio, args=(socket, client_address), name="micThread")
         receive_thread = threading.Thread(target=self.play_audio, args=(socket,), name="audioThread")
         send_thread.start()
@@ -123,9 +1189,47 @@ class audioConnect:
             receive_thread.join()
         except KeyboardInterrupt:
             print("Stopping network audio threads")
+        finally:
+            if audioConnect.active is self:
+                audioConnect.active = None
     #
     # util
     #
 
+    def get_vad_stats(self):
+        return {"speech_frames": self.vad.speech_frames, "silent_frames": self.vad.silent_frames, "noise_level": self.vad.noise_level}
+
+    # callback duration histograms & deadline misses, only recorded while instrumentation is on
+    def set_instrumentation(self, enabled):
+        self.input_monitor.enabled = enabled
+        self.output_monitor.enabled = enabled
+
+    def get_callback_stats(self):
+        return {"input": self.input_monitor.get_stats(), "output": self.output_monitor.get_stats(), "input_overruns": self.input_ring.overruns}
+
+    def get_echo_stats(self):
+        return self.canceller.get_stats()
+
+    def set_echo_cancel(self, enabled):
+        if enabled and not self.echo_cancel:
+            self.canceller.reset()
+        self.echo_cancel = enabled
+
+    def get_jitter_stats(self):
+        return self.audio_queue.get_stats()
+
+    def get_playout_stats(self):
+        return {"buffered_frames": self.playout_ring.available(), "underruns": self.playout_ring.underruns, "overruns": self.playout_ring.overruns,
+                **self.concealer.get_stats()}
+
+    # input & output rms / peak in dB for level meters
+    def get_levels(self):
+        return {"input": self.input_gain.get_levels(), "output": self.output_gain.get_levels()}
+
     def set_volume_level(self, volume_level):
-        self.output_volume = volume_level
\ No newline at end of file
+        self.output_volume = volume_level
+        self.output_gain.set_volume(volume_level)
+
+    def set_input_volume_level(self, volume_level):
+        self.input_volume = volume_level
+        self.input_gain.set_volume(volume_level)
\ No newline at end of file
@@ -17,7 +17,7 @@ class chatConnect:
     def __init__(self):
         self.headerClass = header()
         self.maxText = 125
-        self.chat_queue = queue.Queue()
+        self.chat_queue = queue.Queue(maxsize=100)
         
         self.sending = True
     
@@ -48,8 +48,6 @@ class chatConnect:
     Starts threads for chat sending & receiving
     """
     def network_chat(self, socket, client_address):
-        self.headerClass.set_chat_queue(chat_queue=self.chat_queue)
-
         send_thread = threading.Thread(target=self.send_chat, args=(socket, client_address), name="sendChatThread")
         receive_thread = threading.Thread(target=self.print_chat, args=(), name="receiveChatThread")
         
\ No newline at end of file
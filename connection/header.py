@@ -8,10 +8,251 @@ Repository: https://github.com/IanDMacDougall/lightwave
 """
 
 import struct
-import pickle
 import cv2
 import numpy as np
 import time
+import queue
+import socket as sock
+import threading
+from collections import deque
+
+
+MAX_DATAGRAM = 65536    # largest UDP payload fits
+VIDEO_CHUNK_SIZE = 1200 # video payload per datagram, keeps packets under a 1500 byte path MTU
+MAX_VIDEO_FRAME = 8 * 1024 * 1024   # largest frame a receiver will reassemble
+
+# Video payload structure: [codec id (1 byte) | flags (1 byte) | width (2 bytes) | height (2 bytes)] followed by the compressed frame
+VIDEO_FORMAT = 'B B H H'
+video_struct = struct.Struct( VIDEO_FORMAT )
+
+JPEG_CODEC = 1
+TILE_CODEC = 2          # only the tiles that changed, patched into the receiver's canvas
+VIDEO_KEYFRAME = 0x01   # frame decodes on its own, always set for JPEG & for tile refreshes
+
+# Tile payload structure, after the video sub-header: [tile size (2 bytes) | tile count (2 bytes)]
+# then one 2 byte tile index ( row * columns + column ) per tile, then one JPEG holding the tiles MOSAIC_COLUMNS to a row
+TILE_FORMAT = 'H H'
+tile_struct = struct.Struct( TILE_FORMAT )
+MOSAIC_COLUMNS = 16
+
+# Control message structure: [kind (1 byte)] followed by the kind's own fields
+CONTROL_FORMAT = 'B'
+control_struct = struct.Struct( CONTROL_FORMAT )
+KEYFRAME_REQUEST = 1    # receiver lost video, sender refreshes every tile
+SENDER_REPORT = 2       # [sender clock in ms (4 bytes)], echoed back in the receiver report to measure round trip time
+RECEIVER_REPORT = 3     # [video bytes/s received (4 bytes) | chunk loss per mille (2 bytes) | echoed sender clock (4 bytes) | ms held since (4 bytes)]
+sender_report_struct = struct.Struct( 'I' )
+receiver_report_struct = struct.Struct( 'I H I I' )
+LAYER_SUBSCRIBE = 4     # [layer mask (1 byte)], bit n asks for simulcast layer n, the sender only encodes the layers asked for
+layer_subscribe_struct = struct.Struct( 'B' )
+
+
+"""
+Builds a video payload from a compressed frame ( e.g. the array cv2.imencode returns )
+ - returned as parts, the sub-header & a view of the compressed bytes, so the frame is never copied, see send_frame
+"""
+def build_video_payload( compressed, width, height, codec_id=JPEG_CODEC, flags=VIDEO_KEYFRAME ):
+    return [ video_struct.pack( codec_id, flags, width, height ), memoryview( compressed ).cast( 'B' ) ]
+
+
+"""
+Reads a video payload's sub-header, returns ( codec id, flags, width, height, compressed bytes as a memoryview )
+"""
+def parse_video_payload( payload ):
+    payload = memoryview( payload )
+    if payload.nbytes < video_struct.size:
+        raise ValueError( "Video payload shorter than its header" )
+    codec_id, flags, width, height = video_struct.unpack_from( payload, 0 )
+    return codec_id, flags, width, height, payload[ video_struct.size: ]
+
+
+"""
+Builds a tile payload from the changed tiles' indices & the JPEG mosaic of those tiles
+ - returned as parts like build_video_payload
+"""
+def build_tile_payload( mosaic, indices, tile_size, width, height, flags=0 ):
+    indices = np.ascontiguousarray( indices, dtype=np.uint16 )
+    sub_header = bytearray( video_struct.size + tile_struct.size )
+    video_struct.pack_into( sub_header, 0, TILE_CODEC, flags, width, height )
+    tile_struct.pack_into( sub_header, video_struct.size, tile_size, len( indices ) )
+    return [ sub_header, memoryview( indices ).cast( 'B' ), memoryview( mosaic ).cast( 'B' ) ]
+
+
+"""
+Views a payload as a list of byte parts, a payload is one buffer or a list of buffers sent back to back
+"""
+def payload_parts( payload ):
+    if not isinstance( payload, ( list, tuple ) ):
+        payload = [ payload ]
+    return [ memoryview( part ).cast( 'B' ) for part in payload ]
+
+
+"""
+Size in bytes of a payload given as one buffer or a list of parts
+"""
+def payload_size( payload ):
+    return sum( part.nbytes for part in payload_parts( payload ) )
+
+
+"""
+Reads a tile payload, returns ( flags, width, height, tile size, tile indices, JPEG mosaic as a memoryview )
+"""
+def parse_tile_payload( payload ):
+    codec_id, flags, width, height, data = parse_video_payload( payload )
+    if codec_id != TILE_CODEC or data.nbytes < tile_struct.size:
+        raise ValueError( "Not a tile payload" )
+    tile_size, tile_count = tile_struct.unpack_from( data, 0 )
+    end = tile_struct.size + 2 * tile_count
+    indices = np.frombuffer( data[ tile_struct.size:end ], dtype=np.uint16 )
+    return flags, width, height, tile_size, indices, data[ end: ]
+
+
+"""
+Decodes a video payload into a BGR image
+ - the compressed bytes go to cv2.imdecode through np.frombuffer, nothing is copied before decoding
+"""
+def decode_video( payload, flags=cv2.IMREAD_COLOR ):
+    codec_id, _, _, _, data = parse_video_payload( payload )
+    if codec_id != JPEG_CODEC:
+        raise ValueError( f"Unknown video codec {codec_id}" )
+    image = cv2.imdecode( np.frombuffer( data, dtype=np.uint8 ), flags )
+    if image is None:
+        raise ValueError( "Could not decode video frame" )
+    return image
+
+
+"""
+Pool of preallocated receive buffers
+ - recvfrom_into fills a pooled bytearray instead of allocating a new bytes object per datagram
+ - when the pool is empty a new buffer is made ( counted as a miss ) and it joins the pool on release
+"""
+class bufferPool:
+    def __init__( self, count=64, size=MAX_DATAGRAM ):
+        self.size = size
+        self.buffers = deque( bytearray( size ) for _ in range( count ) )
+        self.allocated = count
+        self.misses = 0
+
+    def acquire( self ):
+        try:
+            return self.buffers.pop()
+        except IndexError:
+            self.misses += 1
+            self.allocated += 1
+            return bytearray( self.size )
+
+    def release( self, buffer ):
+        self.buffers.append( buffer )
+
+    def available( self ):
+        return len( self.buffers )
+
+
+"""
+One datagram received into a pooled buffer
+ - payload is a memoryview into the pooled buffer, it is only valid until release() is called
+ - the consumer releases the packet once it has decoded the payload
+"""
+class receivedPacket:
+    __slots__ = ( "data_type", "seq_num", "timestamp", "payload", "addr", "buffer", "pool" )
+
+    def __init__( self, data_type, seq_num, timestamp, payload, addr, buffer, pool ):
+        self.data_type = data_type
+        self.seq_num = seq_num
+        self.timestamp = timestamp
+        self.payload = payload
+        self.addr = addr
+        self.buffer = buffer
+        self.pool = pool
+
+    def release( self ):
+        if self.buffer is not None:
+            self.pool.release( self.buffer )
+            self.payload = None
+            self.buffer = None
+
+
+"""
+Rebuilds chunked video frames
+ - chunks are copied into a frame buffer at index * chunk size, a frame is complete once every chunk arrived
+ - the table holds at most max_frames frames, the oldest is evicted when full or once older than timeout
+ - a completed frame evicts every unfinished older frame, those will never be shown anyway
+ - missing chunks of evicted frames are counted as lost
+ - chunks that don't agree with the frame's first chunk or ask for an oversized frame are dropped & counted in bad_chunks
+"""
+class frameReassembler:
+    def __init__( self, max_frames=8, timeout=0.5 ):
+        self.max_frames = max_frames
+        self.timeout = timeout
+        self.frames = {}    # frame id -> [ buffer, chunks received, received flags, arrival time ]
+        self.newest_complete = -1
+
+        self.chunks_received = 0
+        self.chunks_lost = 0
+        self.frames_completed = 0
+        self.frames_dropped = 0
+        self.bad_chunks = 0
+
+    """
+    adds one chunk, returns a memoryview of the whole frame once it is complete otherwise None
+    """
+    def add_chunk( self, frame_id, chunk_index, chunk_count, frame_size, chunk ):
+        if chunk_index >= chunk_count:
+            self.bad_chunks += 1
+            return None
+        if frame_id <= self.newest_complete:
+            return None     # late chunk of a frame already shown or dropped
+
+        now = time.monotonic()
+        entry = self.frames.get( frame_id )
+        if entry is None:
+            if frame_size > min( chunk_count * VIDEO_CHUNK_SIZE, MAX_VIDEO_FRAME ):
+                self.bad_chunks += 1
+                return None
+            self.evict_expired( now )
+            while len( self.frames ) >= self.max_frames:
+                self.evict( min( self.frames ) )
+            entry = [ bytearray( frame_size ), 0, bytearray( chunk_count ), now ]
+            self.frames[ frame_id ] = entry
+
+        buffer, received, flags, _ = entry
+        chunk_size = -( -frame_size // chunk_count )
+        offset = chunk_index * chunk_size
+        if chunk_count != len( flags ) or frame_size != len( buffer ) or len( chunk ) > chunk_size or offset + len( chunk ) > frame_size:
+            self.bad_chunks += 1
+            return None
+        if flags[ chunk_index ]:
+            return None     # duplicate
+        buffer[ offset:offset + len( chunk ) ] = chunk
+        flags[ chunk_index ] = 1
+        entry[ 1 ] = received + 1
+        self.chunks_received += 1
+
+        if entry[ 1 ] < chunk_count:
+            return None
+
+        del self.frames[ frame_id ]
+        self.frames_completed += 1
+        self.newest_complete = frame_id
+        for older_id in [ older_id for older_id in self.frames if older_id < frame_id ]:
+            self.evict( older_id )
+        return memoryview( buffer )
+
+    def evict_expired( self, now ):
+        for frame_id in [ frame_id for frame_id, entry in self.frames.items() if now - entry[ 3 ] > self.timeout ]:
+            self.evict( frame_id )
+
+    def evict( self, frame_id ):
+        _, received, flags, _ = self.frames.pop( frame_id )
+        self.chunks_lost += len( flags ) - received
+        self.frames_dropped += 1
+
+    def loss_percent( self ):
+        total = self.chunks_received + self.chunks_lost
+        if total == 0:
+            return 0
+        return ( self.chunks_lost / total ) * 100
+
 
 class header:
     def __init__(self):    
@@ -23,15 +264,50 @@ class header:
         # Using struct format: B = unsigned char, I = unsigned int, Q = unsigned long long
         self.HEADER_FORMAT = 'B I I Q'  
         self.header_size = struct.calcsize( self.HEADER_FORMAT )
+        self.header_struct = struct.Struct( self.HEADER_FORMAT )
+
+        # reusable header buffers, one per data type so audio / video / chat never share one
+        self.header_buffers = {}
+
+        # Video chunk structure: [frame id (4 bytes) | chunk index (2 bytes) | chunk count (2 bytes) | frame size (4 bytes) | layer (1 byte)]
+        # the layer is the simulcast layer ( 0 full size, 1 half, 2 quarter ), frames without simulcast are all layer 0
+        self.CHUNK_FORMAT = 'I H H I B'
+        self.chunk_struct = struct.Struct( self.CHUNK_FORMAT )
+        self.chunk_size = self.chunk_struct.size
+        self.chunk_header_buffer = bytearray( self.chunk_size )
+        self.video_seq = 0
 
         # Types of data being sent & recieved
         self.AUDIO_TYPE = 0
         self.VIDEO_TYPE = 1
         self.CHAT_TYPE = 2
+        self.CONTROL_TYPE = 3
 
         self.audio_queue = None
         self.video_queue = None
         self.chat_queue = None
+        self.control_listener = None
+        self.control_lock = threading.Lock()    # reports & keyframe requests are sent from different threads
+
+        self.buffer_pool = None     # made on the first receive, send only headers never need one
+        self.reassemblers = {}      # layer -> frameReassembler, layers share frame ids so each one is rebuilt on its own
+        self.video_layers = None    # layer mask to keep, None keeps every layer
+
+        # dispatcher: every datagram on the socket is read once here and routed by data type
+        self.handlers = {
+            self.AUDIO_TYPE: self.handle_audio,
+            self.VIDEO_TYPE: self.handle_video,
+            self.CHAT_TYPE: self.handle_chat,
+            self.CONTROL_TYPE: self.handle_control,
+        }
+        self.receiving = True
+        self.received_packets = { data_type: 0 for data_type in self.handlers }
+        self.dropped_packets = { data_type: 0 for data_type in self.handlers }
+        self.unknown_packets = 0
+        self.short_packets = 0
+        self.handler_errors = 0
+        self.video_bytes_received = 0
+        self.layer_drops = 0
 
 
 
@@ -43,52 +319,215 @@ class header:
 
 
     """
-    makes data header and connects data to header 
-    Then sends this completed data to the given address ( addr ) through socket
+    packs the header into the reusable buffer of the given data type ( no new bytes object per packet )
+    """
+    def pack_header( self, data_type, seq_num, data_length, timestamp ):
+        header_buffer = self.header_buffers.get( data_type )
+        if header_buffer is None:
+            header_buffer = bytearray( self.header_size )
+            self.header_buffers[ data_type ] = header_buffer
+        self.header_struct.pack_into( header_buffer, 0, data_type, seq_num, data_length, timestamp )
+        return header_buffer
+
+
+    """
+    makes data header and sends it together with the data to the given address ( addr ) through socket
+     - data_send is one buffer or a list of parts ( e.g. a sub-header & its data ), see payload_parts
+     - the payload is never copied in python, see send_parts
     """    
     def send_data( self, socket, addr, data_type, seq_num, data_send, timestamp ):
-        header = self.create_header(data_type, seq_num, len(data_send), timestamp)
-        messsage = header + data_send
-        socket.sendto(messsage, addr)
+        parts = payload_parts( data_send )
+        header_buffer = self.pack_header( data_type, seq_num, sum( part.nbytes for part in parts ), timestamp )
+
+        self.send_parts( socket, addr, [ header_buffer ] + parts )
+
+
+    """
+    splits an encoded frame into chunks of at most VIDEO_CHUNK_SIZE and sends each one as its own datagram
+     - chunks are split evenly, so the receiver finds each chunk's offset from the frame size & chunk count alone
+     - a frame given as parts is chunked as if the parts were back to back, a chunk spanning two parts gathers a slice of each
+     - the sequence number counts chunks, so loss is measured per chunk
+     - every chunk carries the frame's simulcast layer, so a receiver or relay can drop the layers it doesn't want before reassembly
+    """
+    def send_frame( self, socket, addr, frame_id, data_send, timestamp, data_type=1, layer=0 ):
+        parts = payload_parts( data_send )
+        frame_size = sum( part.nbytes for part in parts )
+        chunk_count = max( 1, -( -frame_size // VIDEO_CHUNK_SIZE ) )
+        chunk_length = -( -frame_size // chunk_count )
+        part_index, part_offset = 0, 0
+
+        for chunk_index in range( chunk_count ):
+            chunk_bytes = max( 0, min( chunk_length, frame_size - chunk_index * chunk_length ) )
+            header_buffer = self.pack_header( data_type, self.video_seq, self.chunk_size + chunk_bytes, timestamp )
+            self.chunk_struct.pack_into( self.chunk_header_buffer, 0, frame_id, chunk_index, chunk_count, frame_size, layer )
+            datagram = [ header_buffer, self.chunk_header_buffer ]
+            remaining = chunk_bytes
+            while remaining and part_index < len( parts ):
+                piece = parts[ part_index ][ part_offset:part_offset + remaining ]
+                datagram.append( piece )
+                remaining -= piece.nbytes
+                part_offset += piece.nbytes
+                if part_offset == parts[ part_index ].nbytes:
+                    part_index, part_offset = part_index + 1, 0
+            self.send_parts( socket, addr, datagram )
+            self.video_seq = ( self.video_seq + 1 ) & 0xFFFFFFFF
 
 
     """
-    takes user's socket and receives data ( max UDP from socket due to audio and video being large sets of data )
-    depending on the data, it is process and this processed data is played or displayed for the user
+    sends header & payload parts as one datagram
+     - sendmsg gathers them in the kernel, sockets without sendmsg ( Windows ) fall back to joining them
+    """
+    def send_parts( self, socket, addr, parts ):
+        if hasattr( socket, "sendmsg" ):
+            socket.sendmsg( parts, [], 0, addr )
+        else:
+            socket.sendto( b"".join( parts ), addr )
+
+
+    """
+    takes user's socket and receives one datagram into a pooled buffer ( max UDP from socket due to audio and video being large sets of data )
+    the packet is routed by its data type through the handler table, the handler owns the packet from then on
+     - packets shorter than a header or with an unknown data type are counted and dropped
     """    
     def receive_data(self, socket):
-        data_receive, addr = socket.recvfrom( 65527 )   # receives video
-        header_data = data_receive[ :self.header_size ]       # takes header
-        data_payload = data_receive[ self.header_size: ]      # 
+        if self.buffer_pool is None:
+            self.buffer_pool = bufferPool()
+        buffer = self.buffer_pool.acquire()
+        try:
+            nbytes, addr = socket.recvfrom_into( buffer )
+        except Exception:
+            self.buffer_pool.release( buffer )
+            raise
+
+        if nbytes < self.header_size:
+            self.short_packets += 1
+            self.buffer_pool.release( buffer )
+            return
+
+        data_type, seq_num, data_len, timestamp = self.header_struct.unpack_from( buffer, 0 )
+
+        handler = self.handlers.get( data_type )
+        if handler is None:
+            self.unknown_packets += 1
+            self.buffer_pool.release( buffer )
+            return
 
-        data_type, seq_num, data_len, timestamp = struct.unpack( self.HEADER_FORMAT, header_data )
+        data_lenCheck = nbytes - self.header_size
+        if data_lenCheck:
+            self.packetLossPercent = ( ( data_len - data_lenCheck ) / data_lenCheck ) * 100
 
-        data_lenCheck = len( data_payload )
-        self.packetLossPercent = ( ( data_len - data_lenCheck ) / data_lenCheck ) * 100
+        self.received_packets[ data_type ] += 1
+        packet = receivedPacket( data_type, seq_num, timestamp, memoryview( buffer )[ self.header_size:nbytes ], addr, buffer, self.buffer_pool )
+        try:
+            handler( packet )
+        except Exception:
+            packet.release()
+            raise
 
-        # data for audio
-        if data_type == self.AUDIO_TYPE:   
-            self.audio_latency = time.time() - timestamp 
-            if( self.audio_queue != None ):
-                self.audio_queue.put( np.frombuffer( data_payload, dtype=np.float32 ) )
 
-        # data for video
-        elif data_type == self.VIDEO_TYPE:   
-            self.video_latency = time.time() - timestamp
-            if( self.video_queue != None ):
+    """
+    Single receive loop for a socket, the only reader of that socket
+     - runs until stop_receiving() is called, the timeout lets it notice the stop
+     - a packet that can't be handled is counted in handler_errors & skipped, the other media keep flowing
+    """
+    def receive_loop(self, socket, timeout=0.5):
+        socket.settimeout( timeout )
+        while self.receiving:
+            try:
+                self.receive_data( socket )
+            except sock.timeout:
+                pass
+            except OSError as E:
+                if not self.receiving:
+                    break
+                print( f"receive_loop error: {E}" )
+            except Exception as E:
+                self.handler_errors += 1
+                print( f"receive_loop handler error: {E}" )
+
+    def stop_receiving(self):
+        self.receiving = False
+
+
+    """
+    puts an item into a bounded media queue, dropping the oldest item when it is full
+    dropped packets give their buffer back to the pool
+    """
+    def put_bounded( self, media_queue, data_type, item ):
+        while True:
+            try:
+                media_queue.put_nowait( item )
+                return
+            except queue.Full:
                 try:
-                    while self.video_queue.full():
-                        self.video_queue.get_nowait()
-                    self.video_queue.put( cv2.resize( cv2.imdecode( pickle.loads( data_payload ), cv2.IMREAD_COLOR ), ( self.width, self.height ) ) )
-                except Exception as E:
-                    print( " ", E )
-            
-        
-        # data for chat
-        elif data_type == self.CHAT_TYPE:   
-            self.chat_latency = time.time() - timestamp
-            if( self.chatConnectClass != None ):
-                self.chatConnectClass.receive_chat( str( data_payload ), addr )
+                    dropped = media_queue.get_nowait()
+                except queue.Empty:
+                    continue
+                self.dropped_packets[ data_type ] += 1
+                if isinstance( dropped, receivedPacket ):
+                    dropped.release()
+
+
+    #
+    # handlers
+    #
+
+    # audio keeps its buffer, the audio callback releases it once played
+    # audio timestamps are the sender's media clock in samples, the jitter buffer measures its latency
+    def handle_audio( self, packet ):
+        if( self.audio_queue != None ):
+            self.put_bounded( self.audio_queue, self.AUDIO_TYPE, packet )
+        else:
+            packet.release()
+
+    # video chunks are copied into the reassembler, so the buffer goes straight back to the pool
+    # a completed frame is queued still compressed with its arrival time, frame id & layer, decoding happens on videoConnect's decode thread
+    # chunks of layers outside video_layers are dropped unread & counted in layer_drops, not as loss
+    def handle_video( self, packet ):
+        self.video_latency = time.time() - packet.timestamp
+        self.video_bytes_received += len( packet.payload )
+        if len( packet.payload ) < self.chunk_size:
+            self.short_packets += 1
+            packet.release()
+            return
+
+        frame_id, chunk_index, chunk_count, frame_size, layer = self.chunk_struct.unpack_from( packet.payload, 0 )
+        if self.video_layers is not None and not ( self.video_layers >> layer ) & 1:
+            self.layer_drops += 1
+            packet.release()
+            return
+
+        reassembler = self.reassemblers.get( layer )
+        if reassembler is None:
+            reassembler = self.reassemblers[ layer ] = frameReassembler()
+        frame_data = reassembler.add_chunk( frame_id, chunk_index, chunk_count, frame_size, packet.payload[ self.chunk_size: ] )
+        packet.release()
+
+        if frame_data is not None and self.video_queue != None:
+            self.put_bounded( self.video_queue, self.VIDEO_TYPE, ( time.monotonic(), frame_id, layer, frame_data ) )
+
+    def handle_chat( self, packet ):
+        self.chat_latency = time.time() - packet.timestamp
+        if( self.chat_queue != None ):
+            self.put_bounded( self.chat_queue, self.CHAT_TYPE, str( packet.payload, "utf-8", "replace" ) )
+        packet.release()
+
+
+    # control messages are tiny & rare, the listener runs on the receive thread
+    def handle_control( self, packet ):
+        if self.control_listener != None and len( packet.payload ) >= control_struct.size:
+            self.control_listener( bytes( packet.payload ) )
+        packet.release()
+
+
+    """
+    sends a control message ( e.g. a KEYFRAME_REQUEST ) to the peer
+     - thread safe, the control header buffer is only packed & sent under control_lock
+    """
+    def send_control( self, socket, addr, kind, fields=b"" ):
+        message = control_struct.pack( kind ) + fields
+        with self.control_lock:
+            self.send_data( socket, addr, self.CONTROL_TYPE, 0, message, int( time.time() ) )
 
 
     #
@@ -106,6 +545,13 @@ class header:
     def set_chat_queue(self, chat_queue):
         self.chat_queue = chat_queue
 
+    def set_control_listener(self, control_listener):
+        self.control_listener = control_listener
+
+    # simulcast layers to keep as a bit mask ( bit n for layer n ), None keeps them all
+    def set_video_layers(self, video_layers):
+        self.video_layers = video_layers
+
 
     # Get
     def getAudioLatency(self):
@@ -121,7 +567,20 @@ class header:
         return 0
     
     def getVideoPacketLoss(self):
-        return 0
+        received, lost = self.video_chunk_counts()
+        if received + lost == 0:
+            return 0
+        return ( lost / ( received + lost ) ) * 100
+
+    # ( chunks received, chunks lost ) summed over every layer's reassembler
+    def video_chunk_counts(self):
+        reassemblers = list( self.reassemblers.values() )
+        return sum( r.chunks_received for r in reassemblers ), sum( r.chunks_lost for r in reassemblers )
+
+    def getReceiveCounters(self):
+        return { "received": dict( self.received_packets ), "dropped": dict( self.dropped_packets ),
+                 "unknown": self.unknown_packets, "short": self.short_packets, "handler_errors": self.handler_errors,
+                 "layer_drops": self.layer_drops, "bad_chunks": sum( r.bad_chunks for r in list( self.reassemblers.values() ) ) }
 
 
 
@@ -7,98 +7,997 @@ File Description: Manages video connection aspects.
 Repository: https://github.com/IanDMacDougall/lightwave
 """
 
-from .header import header
+from .header import (header, build_video_payload, payload_size, decode_video, parse_video_payload, build_tile_payload, parse_tile_payload,
+                     TILE_CODEC, VIDEO_KEYFRAME, MOSAIC_COLUMNS, KEYFRAME_REQUEST, SENDER_REPORT, RECEIVER_REPORT,
+                     LAYER_SUBSCRIBE, sender_report_struct, receiver_report_struct, layer_subscribe_struct, control_struct)
 
 import cv2
-import pickle
 import queue
 import threading
 import numpy as np
 import time
+import os
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+"""
+Pool of reusable frame buffers keyed by shape & dtype, shared by capture, decode, encode & the display
+ - acquire returns a buffer holding one reference, retain & release count references, at 0 it goes back to the pool
+ - frames that didn't come from the pool are ignored by retain & release, so every frame can be handed over the same way
+ - at most max_free buffers of a shape wait in the pool, shapes not asked for in IDLE_SECONDS are freed ( e.g. after a resize )
+"""
+class framePool:
+    IDLE_SECONDS = 2.0
+
+    def __init__(self, max_free=8):
+        self.max_free = max_free
+        self.lock = threading.Lock()
+        self.free = {}          # ( shape, dtype ) -> buffers ready for reuse
+        self.last_used = {}     # ( shape, dtype ) -> time it was last asked for
+        self.refs = {}          # id( buffer ) -> [ buffer, references ]
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0          # every buffer the pool owns, in use & free
+        self.peak_bytes = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype))
+        now = time.monotonic()
+        with self.lock:
+            self.last_used[key] = now
+            free = self.free.get(key)
+            if free:
+                self.hits += 1
+                buffer = free.pop()
+            else:
+                self.misses += 1
+                self.trim(now)
+                buffer = np.empty(key[0], dtype=key[1])
+                self.bytes += buffer.nbytes
+                self.peak_bytes = max(self.peak_bytes, self.bytes)
+            self.refs[id(buffer)] = [buffer, 1]
+            return buffer
+
+    def retain(self, frame):
+        with self.lock:
+            entry = self.refs.get(id(frame))
+            if entry is not None and entry[0] is frame:
+                entry[1] += 1
+        return frame
+
+    def release(self, frame):
+        with self.lock:
+            entry = self.refs.get(id(frame))
+            if entry is None or entry[0] is not frame:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self.refs[id(frame)]
+            key = (frame.shape, frame.dtype)
+            free = self.free.setdefault(key, [])
+            if key in self.last_used and len(free) < self.max_free:
+                free.append(frame)
+            else:
+                self.bytes -= frame.nbytes
+
+    # frees the waiting buffers of shapes nobody asked for lately
+    def trim(self, now):
+        for key in [key for key, used in self.last_used.items() if now - used > self.IDLE_SECONDS]:
+            del self.last_used[key]
+            self.bytes -= sum(buffer.nbytes for buffer in self.free.pop(key, ()))
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / requests if requests else 0.0,
+                    "in_use": len(self.refs), "free": sum(len(free) for free in self.free.values()),
+                    "bytes": self.bytes, "peak_bytes": self.peak_bytes}
+
+
+"""
+Single slot frame mailbox, a write always replaces the frame in the slot
+ - every write bumps the generation, readers pass the last generation they saw & wait on the condition for a newer one
+ - so each reader gets the newest frame exactly once & never spins
+ - a frame overwritten before any reader took it counts as dropped
+ - with a frame_pool the slot holds a reference to its frame & get retains the frame for the reader, who releases it when done
+"""
+class frameMailbox:
+    def __init__(self, frame_pool=None):
+        self.frame_pool = frame_pool
+        self.condition = threading.Condition()
+        self.frame = None
+        self.generation = 0
+        self.capture_time = 0.0
+        self.taken = True
+        self.closed = False
+
+        self.frames = 0
+        self.drops = 0
+        self.fps = 0.0
+        self.age = 0.0
+        self.max_age = 0.0
+
+    def put(self, frame):
+        now = time.monotonic()
+        with self.condition:
+            if not self.taken:
+                self.drops += 1
+            if self.frames:
+                interval = now - self.capture_time
+                if interval > 0:
+                    self.fps += 0.1 * (1 / interval - self.fps)
+            if self.frame_pool is not None:
+                self.frame_pool.retain(frame)
+                if self.frame is not None:
+                    self.frame_pool.release(self.frame)
+            self.frame = frame
+            self.capture_time = now
+            self.generation += 1
+            self.frames += 1
+            self.taken = False
+            self.condition.notify_all()
+
+    # returns ( frame, generation ), frame is None on timeout or once closed
+    def get(self, generation=0, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.generation != generation or self.closed, timeout) or self.generation == generation:
+                return None, generation
+            age = time.monotonic() - self.capture_time
+            self.age += 0.1 * (age - self.age)
+            self.max_age = max(self.max_age, age)
+            self.taken = True
+            if self.frame_pool is not None and self.frame is not None:
+                self.frame_pool.retain(self.frame)
+            return self.frame, self.generation
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get_stats(self):
+        with self.condition:
+            return {"captured": self.frames, "fps": self.fps, "dropped": self.drops, "age_ms": self.age * 1000, "max_age_ms": self.max_age * 1000}
+
+
+# 32 bit millisecond clock carried in sender reports, never 0 since 0 means no report to echo
+def report_clock():
+    return int(time.monotonic() * 1000) & 0xFFFFFFFF or 1
+
+
+"""
+Reads the width & height from a JPEG's start of frame marker without decoding it, None if there is none
+"""
+def jpeg_size(data):
+    data = memoryview(data).cast('B')
+    if len(data) < 2 or data[0] != 0xFF or data[1] != 0xD8:
+        return None     # no start of image marker, not a JPEG
+    index = 2
+    while index + 9 <= len(data):
+        if data[index] != 0xFF:
+            return None
+        marker = data[index + 1]
+        if marker == 0xFF:
+            index += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            index += 2     # markers without a length
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = data[index + 5] << 8 | data[index + 6]
+            width = data[index + 7] << 8 | data[index + 8]
+            return width, height
+        else:
+            index += 2 + (data[index + 2] << 8 | data[index + 3])
+    return None
+
+
+"""
+True for a frame the camera delivered still JPEG compressed ( MJPG capture with CAP_PROP_CONVERT_RGB off )
+"""
+def is_compressed(frame):
+    return frame.ndim == 1 or frame.ndim == 2 and frame.shape[0] == 1
+
+
+"""
+Size a width x height frame is sent at, fitted in max_size ( width, height ) keeping its aspect ratio then divided by scale
+"""
+def fit_size(width, height, max_size, scale=1):
+    if max_size is not None and (width > max_size[0] or height > max_size[1]):
+        fit = min(max_size[0] / width, max_size[1] / height)
+        width, height = int(width * fit), int(height * fit)
+    return max(1, width // scale), max(1, height // scale)
+
+
+"""
+Scales a frame down to fit in max_size ( width, height ) keeping its aspect ratio, smaller frames are returned as they are
+"""
+def fit_frame(frame, max_size):
+    height, width = frame.shape[:2]
+    size = fit_size(width, height, max_size)
+    if size == (width, height):
+        return frame
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+"""
+Views a padded frame as tiles, indexed [ row, column ] -> ( tile, tile, 3 )
+"""
+def tile_view(frame, tile_size):
+    rows, columns = frame.shape[0] // tile_size, frame.shape[1] // tile_size
+    return frame.reshape(rows, tile_size, columns, tile_size, 3).swapaxes(1, 2)
+
+
+"""
+Finds the tiles of a frame that changed since they were last sent
+ - frames are padded to whole tiles, tiles are compared against the reference by their sum of absolute differences
+ - a tile changed when its mean absolute difference is over threshold, camera noise stays below it
+ - every tile is sent ( a refresh ) on the first frame, every refresh_interval frames & when the receiver asks after loss
+ - the reference only takes the tiles that were sent, so slow drift still adds up to a change
+"""
+class tileEncoder:
+    def __init__(self, tile_size=64, threshold=2.0, refresh_interval=150):
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.reference = None
+        self.padded = None
+        self.frames_since_refresh = 0
+        self.refresh_requested = True
+
+        self.frames = 0
+        self.tiles_sent = 0
+        self.tiles_total = 0
+        self.refreshes = 0
+
+    def request_refresh(self):
+        self.refresh_requested = True
+
+    """
+    returns ( indices, mosaic, refresh ) for the tiles to send, None when nothing changed
+    """
+    def changed_tiles(self, frame):
+        tile_size = self.tile_size
+        height, width = frame.shape[:2]
+        padded_height, padded_width = -(-height // tile_size) * tile_size, -(-width // tile_size) * tile_size
+        if (padded_height, padded_width) != (height, width):
+            if self.padded is None or self.padded.shape[:2] != (padded_height, padded_width):
+                self.padded = np.empty((padded_height, padded_width, 3), dtype=np.uint8)
+            cv2.copyMakeBorder(frame, 0, padded_height - height, 0, padded_width - width, cv2.BORDER_REPLICATE, dst=self.padded)
+            frame = self.padded
+
+        tiles = tile_view(frame, tile_size)
+        rows, columns = tiles.shape[:2]
+        refresh = (self.refresh_requested or self.reference is None or self.reference.shape != frame.shape
+                   or self.frames_since_refresh >= self.refresh_interval)
+        if refresh:
+            changed = np.ones((rows, columns), dtype=bool)
+            self.reference = frame.copy()
+            self.refresh_requested = False
+            self.frames_since_refresh = 0
+            self.refreshes += 1
+        else:
+            # sum of absolute differences per tile: cv2.reduce sums each tile row, numpy adds up the tile's rows
+            difference = cv2.absdiff(frame, self.reference).reshape(rows * tile_size * columns, tile_size * 3)
+            sad = cv2.reduce(difference, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).reshape(rows, tile_size, columns).sum(axis=1)
+            changed = sad > self.threshold * tile_size * tile_size * 3
+            tile_view(self.reference, tile_size)[changed] = tiles[changed]
+        self.frames_since_refresh += 1
+        self.frames += 1
+
+        indices = np.flatnonzero(changed).astype(np.uint16)
+        self.tiles_total += rows * columns
+        self.tiles_sent += len(indices)
+        if not len(indices):
+            return None
+
+        # lay the tiles out MOSAIC_COLUMNS to a row so they go through one JPEG encode
+        mosaic_columns = min(len(indices), MOSAIC_COLUMNS)
+        mosaic_rows = -(-len(indices) // mosaic_columns)
+        mosaic = np.zeros((mosaic_rows * mosaic_columns, tile_size, tile_size, 3), dtype=np.uint8)
+        mosaic[:len(indices)] = tiles[changed]
+        mosaic = mosaic.reshape(mosaic_rows, mosaic_columns, tile_size, tile_size, 3).swapaxes(1, 2).reshape(mosaic_rows * tile_size, mosaic_columns * tile_size, 3)
+        return indices, mosaic, refresh
+
+    def get_stats(self):
+        return {"frames": self.frames, "refreshes": self.refreshes,
+                "tiles_sent_percent": self.tiles_sent / self.tiles_total * 100 if self.tiles_total else 0}
+
+
+"""
+Receiver side of tileEncoder, a persistent canvas the received tiles are patched into
+ - a refresh ( keyframe ) payload resets the canvas, tiles before the first refresh can't be placed & are ignored
+"""
+class tileCanvas:
+    def __init__(self):
+        self.canvas = None
+        self.width = 0
+        self.height = 0
+
+    # returns False if the payload couldn't be applied, the sender needs to refresh
+    def apply(self, payload):
+        flags, width, height, tile_size, indices, mosaic = parse_tile_payload(payload)
+        padded_shape = (-(-height // tile_size) * tile_size, -(-width // tile_size) * tile_size, 3)
+        if flags & VIDEO_KEYFRAME:
+            if self.canvas is None or self.canvas.shape != padded_shape:
+                self.canvas = np.zeros(padded_shape, dtype=np.uint8)
+            self.width, self.height = width, height
+        elif self.canvas is None or self.canvas.shape != padded_shape:
+            return False
+        if not len(indices):
+            return True
+
+        image = cv2.imdecode(np.frombuffer(mosaic, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode tile mosaic")
+        mosaic_rows, mosaic_columns = image.shape[0] // tile_size, image.shape[1] // tile_size
+        tiles = tile_view(image, tile_size).reshape(mosaic_rows * mosaic_columns, tile_size, tile_size, 3)[:len(indices)]
+        canvas_tiles = tile_view(self.canvas, tile_size)
+        columns = canvas_tiles.shape[1]
+        canvas_tiles[indices // columns, indices % columns] = tiles
+        return True
+
+    def frame(self):
+        return self.canvas[:self.height, :self.width]
+
+
+"""
+JPEG encode stage, several frames are encoded at once on a thread pool ( cv2 releases the GIL while encoding )
+ - at most max_in_flight frames are encoding, a frame submitted while it's full is dropped
+ - frames are handed to send as video payloads in frame id order, a frame is only sent once every older one has finished
+ - camera JPEGs within max_size & max_bytes go out unchanged, larger ones are decoded ( reduced where possible ) & re-encoded
+ - without max_bytes the limit is 1.5x what quality gives at the camera's size, re-measured every CALIBRATE_EVERY camera frames
+ - frames bigger than max_size are scaled down to fit before encoding
+ - with scale the frame is also divided by scale after fitting, e.g. 2 for a half size simulcast layer
+ - frames are scaled into buffers from frame_pool, a pooled frame is retained from submit until its payload is sent, a passed through JPEG is sent straight from it
+ - with tiles ( a tileEncoder ) changes are found in submit, in frame order, & only the changed tiles are encoded
+ - a shared executor ( simulcastEncoder's ) is used as it is & left running by close
+"""
+class encodePipeline:
+    CALIBRATE_EVERY = 300
+
+    def __init__(self, send, quality=40, workers=None, max_size=None, max_bytes=None, tiles=None, scale=1, executor=None, frame_pool=None):
+        self.send = send
+        self.tiles = tiles
+        self.quality = quality
+        self.max_size = max_size      # ( width, height ), None for any size
+        self.max_bytes = max_bytes    # largest camera JPEG sent unchanged, None for any
+        self.scale = scale
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_in_flight = self.workers
+        self.own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="videoEncode")
+
+        self.lock = threading.Lock()
+        self.pending = collections.deque()   # ( frame_id, future, retained frame or None ) in frame id order
+        self.next_id = 0
+        self.frame_pool = frame_pool or framePool()
+
+        self.sent = 0
+        self.drops = 0
+        self.errors = 0
+        self.passthrough = 0
+        self.camera_frames = 0
+        self.reference_bytes = None   # size of a camera frame re-encoded at quality
+        self.encode_time = 0.0
+        self.fps = 0.0
+        self.last_sent = 0.0
+
+    # returns False if the frame was dropped because encode is behind, frame_id defaults to the next one of this pipeline
+    def submit(self, frame, frame_id=None):
+        with self.lock:
+            if len(self.pending) >= self.max_in_flight:
+                self.drops += 1
+                return False
+
+        # only the send thread submits, so pending can't fill up in between
+        work = (self.encode, frame)
+        if self.tiles is not None:
+            if is_compressed(frame):
+                frame = cv2.imdecode(frame.reshape(-1), cv2.IMREAD_COLOR)
+            frame = fit_frame(frame, self.max_size)
+            changed = self.tiles.changed_tiles(frame)
+            if changed is None:
+                return True
+            height, width = frame.shape[:2]
+            work = (self.encode_tiles, changed, width, height)
+
+        retained = frame if work[0] == self.encode else None
+        if retained is not None:
+            self.frame_pool.retain(retained)
+        with self.lock:
+            if frame_id is None:
+                frame_id = self.next_id
+                self.next_id = ( self.next_id + 1 ) & 0xFFFFFFFF
+            future = self.executor.submit(*work)
+            self.pending.append((frame_id, future, retained))
+        future.add_done_callback(self.completed)
+        return True
+
+    def encode(self, frame):
+        start = time.perf_counter()
+        target = None
+        if is_compressed(frame):
+            size = jpeg_size(frame)
+            if size is None:
+                raise Exception("Camera frame is not a JPEG")
+            width, height = size
+            target = fit_size(width, height, self.max_size, self.scale)
+            fits = target == (width, height)
+            calibrate = fits and self.max_bytes is None and self.camera_frames % self.CALIBRATE_EVERY == 0
+            self.camera_frames += 1
+            max_bytes = self.max_bytes or (self.reference_bytes or 0) * 1.5
+            if fits and not calibrate and frame.nbytes <= max_bytes:
+                self.passthrough += 1
+                return build_video_payload(frame, width, height), time.perf_counter() - start
+            flag = reduced_decode(width, height, *target)[1] if not fits else cv2.IMREAD_COLOR
+            frame = cv2.imdecode(frame.reshape(-1), flag)
+            if frame is None:
+                raise Exception("Could not decode camera frame")
+            if calibrate:
+                retval, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                self.reference_bytes = buffer.nbytes
+                return build_video_payload(buffer, width, height), time.perf_counter() - start
+
+        # a camera JPEG's target is already set, its reduced decode may be part of the way there
+        if target is None:
+            target = fit_size(frame.shape[1], frame.shape[0], self.max_size, self.scale)
+        width, height = target
+        destination = None
+        if frame.shape[1::-1] != target:
+            destination = self.frame_pool.acquire((height, width) + frame.shape[2:], frame.dtype)
+            frame = cv2.resize(frame, target, dst=destination, interpolation=cv2.INTER_AREA)
+        try:
+            retval, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        finally:
+            if destination is not None:
+                self.frame_pool.release(destination)
+        if not retval:
+            raise Exception("Could not encode frame")
+        return build_video_payload(buffer, width, height), time.perf_counter() - start
+
+    # new quality & size from the rate controller, the passthrough limit is measured again at the new quality
+    def set_target(self, quality, max_size):
+        self.quality = quality
+        self.max_size = max_size
+        self.camera_frames = 0
+
+    def encode_tiles(self, changed, width, height):
+        start = time.perf_counter()
+        indices, mosaic, refresh = changed
+        retval, buffer = cv2.imencode('.jpg', mosaic, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not retval:
+            raise Exception("Could not encode tiles")
+        flags = VIDEO_KEYFRAME if refresh else 0
+        return build_tile_payload(buffer, indices, self.tiles.tile_size, width, height, flags), time.perf_counter() - start
+
+    # runs on whichever worker finished, sends every finished frame at the head of pending
+    def completed(self, future):
+        with self.lock:
+            while self.pending and self.pending[0][1].done():
+                frame_id, done, retained = self.pending.popleft()
+                try:
+                    if done.cancelled():
+                        continue
+                    payload, duration = done.result()
+                    self.send(frame_id, payload)
+                except Exception as E:
+                    self.errors += 1
+                    print(f"Error in encodePipeline: {E}")
+                    continue
+                finally:
+                    # the payload may be a view of the frame ( a passed through JPEG ), so it's kept until sent
+                    if retained is not None:
+                        self.frame_pool.release(retained)
+
+                now = time.monotonic()
+                if self.sent:
+                    self.fps += 0.1 * (1 / max(now - self.last_sent, 1e-6) - self.fps)
+                self.last_sent = now
+                self.encode_time += 0.1 * (duration - self.encode_time)
+                self.sent += 1
+
+    def close(self):
+        if self.own_executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_stats(self):
+        with self.lock:
+            return {"workers": self.workers, "in_flight": len(self.pending), "sent": self.sent, "fps": self.fps,
+                    "dropped": self.drops, "errors": self.errors, "passthrough": self.passthrough, "encode_ms": self.encode_time * 1000}
+
+
+"""
+Simulcast, every captured frame is encoded at several sizes ( full, half & quarter by default ), one encodePipeline per layer
+ - all layers run on one shared thread pool, so the layers of a frame encode in parallel
+ - the layers of one capture share its frame id, send gets the layer index to tag the chunks with
+ - camera JPEGs are decoded reduced per layer, so the small layers never decode the full frame
+ - only the layers in the subscribed mask ( bit n for layer n ) are encoded, the receiver subscribes with LAYER_SUBSCRIBE
+"""
+class simulcastEncoder:
+    SCALES = (1, 2, 4)
+
+    def __init__(self, send, quality=40, workers=None, max_size=None, max_bytes=None, scales=SCALES, frame_pool=None):
+        self.workers = workers or min(6, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="videoEncode")
+        # layers finish on different workers, header.send_frame must not be entered by two at once
+        self.send_lock = threading.Lock()
+        self.layers = [encodePipeline(self.sender(send, layer), quality, self.workers, max_size, max_bytes if scale == 1 else None,
+                                      scale=scale, executor=self.executor, frame_pool=frame_pool) for layer, scale in enumerate(scales)]
+        self.all_layers = (1 << len(self.layers)) - 1
+        self.subscribed = self.all_layers
+        self.next_id = 0
+
+    def sender(self, send, layer):
+        def send_layer(frame_id, payload):
+            with self.send_lock:
+                send(frame_id, payload, layer)
+        return send_layer
+
+    # returns False if every subscribed layer dropped the frame
+    def submit(self, frame):
+        frame_id = self.next_id
+        self.next_id = ( self.next_id + 1 ) & 0xFFFFFFFF
+        submitted = False
+        for layer, pipeline in enumerate(self.layers):
+            if (self.subscribed >> layer) & 1:
+                submitted = pipeline.submit(frame, frame_id) or submitted
+        return submitted
+
+    # max_size is the full layer's, the others keep their scale of it
+    def set_target(self, quality, max_size):
+        for pipeline in self.layers:
+            pipeline.set_target(quality, max_size)
+
+    def subscribe(self, mask):
+        self.subscribed = mask & self.all_layers
+
+    # CPU time a captured frame costs across the subscribed layers
+    @property
+    def encode_time(self):
+        return sum(pipeline.encode_time for layer, pipeline in enumerate(self.layers) if (self.subscribed >> layer) & 1)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_stats(self):
+        layers = [pipeline.get_stats() for pipeline in self.layers]
+        return {"workers": self.workers, "in_flight": sum(layer["in_flight"] for layer in layers),
+                "sent": sum(layer["sent"] for layer in layers),
+                "fps": max([layer["fps"] for n, layer in enumerate(layers) if (self.subscribed >> n) & 1], default=0.0),
+                "dropped": sum(layer["dropped"] for layer in layers), "errors": sum(layer["errors"] for layer in layers),
+                "passthrough": sum(layer["passthrough"] for layer in layers), "encode_ms": self.encode_time * 1000,
+                "subscribed": self.subscribed, "layers": layers}
+
+
+# JPEG decode flags by downscale factor, libjpeg scales while decoding so a reduced decode is several times cheaper
+REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+"""
+Largest JPEG downscale factor that still covers the render size & its flag
+ - the frame is fitted into the render size keeping its aspect ratio, like the video widget paints it
+"""
+def reduced_decode(width, height, render_width, render_height):
+    if width and height:
+        scale = min(render_width / width, render_height / height)
+        for factor, flag in REDUCED_DECODE:
+            if width / factor >= width * scale and height / factor >= height * scale:
+                return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+"""
+Decodes received video off the receive thread
+ - header queues completed frames still compressed, this worker decodes them into the frames mailbox
+ - when more than one frame is waiting only the newest is decoded, the older ones are skipped
+ - frames are decoded at the smallest JPEG scale that still covers the render size
+ - exact sizes resize into a buffer from frame_pool ( cv2 windows ), otherwise the display scales the frame
+ - the worker's reference to a pooled frame is released once the mailbox & listener have retained theirs
+ - tile payloads are patched into a tileCanvas, skipped ones too since later tiles build on them
+ - a gap in frame ids while tiles are in use means the canvas missed tiles, on_loss asks the sender for a refresh
+ - of simulcast layers only one is shown, frames of the others are left out ( counted in layer_skipped )
+   it moves to wanted_layer once that arrives, until one is wanted it moves to any bigger layer it receives
+ - latency is measured from the last chunk arriving to the decoded frame being in the mailbox
+"""
+class decodeWorker:
+    REFRESH_REQUEST_INTERVAL = 0.5  # seconds between refresh requests while tiles are missing
+
+    def __init__(self, source_queue, size=(640, 480), exact=True, frame_pool=None):
+        self.source_queue = source_queue
+        self.size = size
+        self.exact = exact
+        self.frame_pool = frame_pool or framePool()
+        self.reduction = 1
+        self.frames = frameMailbox(self.frame_pool)
+        self.listener = None    # called with every decoded frame, e.g. a video widget
+        self.on_loss = None     # called to ask the sender for a tile refresh
+        self.canvas = tileCanvas()
+        self.last_frame_id = None
+        self.layer = None           # simulcast layer being shown
+        self.wanted_layer = None    # layer to move to, set by videoConnect from the render size
+        self.layers_seen = 0        # mask of every layer received
+        self.source_size = None     # ( width, height ) the shown layer is sent at
+        self.last_refresh_request = 0.0
+        self.refresh_requests = 0
+        self.running = True
+
+        self.decoded = 0
+        self.skipped = 0
+        self.layer_skipped = 0
+        self.errors = 0
+        self.decode_time = 0.0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def run(self):
+        try:
+            while self.running:
+                try:
+                    arrival, frame_id, layer, payload = self.source_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if not self.accept_layer(layer):
+                    continue
+                self.check_gap(frame_id, payload)
+
+                # skip to the newest complete frame
+                while True:
+                    try:
+                        newer = self.source_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if not self.accept_layer(newer[2]):
+                        continue
+                    self.skip(payload)
+                    arrival, frame_id, layer, payload = newer
+                    self.check_gap(frame_id, payload)
+                    self.skipped += 1
+
+                start = time.perf_counter()
+                try:
+                    frame = self.decode(payload)
+                    if frame is None:
+                        continue
+                except Exception as E:
+                    self.errors += 1
+                    print(f"Error in decodeWorker: {E}")
+                    continue
+                self.frames.put(frame)
+                listener = self.listener
+                if listener is not None:
+                    listener(frame)
+                self.frame_pool.release(frame)
+
+                self.decode_time += 0.1 * (time.perf_counter() - start - self.decode_time)
+                latency = time.monotonic() - arrival
+                self.latency += 0.1 * (latency - self.latency)
+                self.max_latency = max(self.max_latency, latency)
+                self.decoded += 1
+        finally:
+            self.frames.close()
+
+    def accept_layer(self, layer):
+        self.layers_seen |= 1 << layer
+        current, wanted = self.layer, self.wanted_layer
+        if current is None or layer == current or layer == wanted or (wanted is None and layer < current):
+            self.layer = layer
+            return True
+        self.layer_skipped += 1
+        return False
+
+    def check_gap(self, frame_id, payload):
+        expected = self.last_frame_id is None or frame_id == ( self.last_frame_id + 1 ) & 0xFFFFFFFF
+        self.last_frame_id = frame_id
+        if not expected and payload[0] == TILE_CODEC:
+            self.request_refresh()
+
+    def request_refresh(self):
+        now = time.monotonic()
+        if self.on_loss is not None and now - self.last_refresh_request >= self.REFRESH_REQUEST_INTERVAL:
+            self.last_refresh_request = now
+            self.refresh_requests += 1
+            self.on_loss()
+
+    # a skipped frame still has to reach the canvas when it carries tiles
+    def skip(self, payload):
+        if payload[0] == TILE_CODEC:
+            try:
+                if not self.canvas.apply(payload):
+                    self.request_refresh()
+            except Exception as E:
+                self.errors += 1
+                self.request_refresh()
+
+    # returns None when there is nothing to show yet
+    def decode(self, payload):
+        render_width, render_height = self.size
+        codec_id, _, width, height, _ = parse_video_payload(payload)
+        self.source_size = (width, height)
+        if codec_id == TILE_CODEC:
+            self.reduction = 1
+            if not self.canvas.apply(payload):
+                self.request_refresh()
+                return None
+            frame = self.canvas.frame()
+        else:
+            self.reduction, flag = reduced_decode(width, height, render_width, render_height)
+            frame = decode_video(payload, flag)
+        if not self.exact or frame.shape[1::-1] == (render_width, render_height):
+            if codec_id != TILE_CODEC:
+                return frame
+            # the canvas keeps changing, the display gets its own copy
+            destination = self.frame_pool.acquire(frame.shape, frame.dtype)
+            np.copyto(destination, frame)
+            return destination
+
+        destination = self.frame_pool.acquire((render_height, render_width, 3), np.uint8)
+        return cv2.resize(frame, (render_width, render_height), dst=destination)
+
+    # called by the display when its size changes, exact=False lets the display scale the frame itself
+    def set_render_size(self, width, height, exact=False):
+        self.size = (max(1, int(width)), max(1, int(height)))
+        self.exact = exact
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        return {"decoded": self.decoded, "skipped": self.skipped, "errors": self.errors, "decode_ms": self.decode_time * 1000,
+                "latency_ms": self.latency * 1000, "max_latency_ms": self.max_latency * 1000, "reduction": self.reduction, "render_size": self.size,
+                "refresh_requests": self.refresh_requests, "layer": self.layer, "layer_skipped": self.layer_skipped, "source_size": self.source_size}
+
+
+"""
+Adaptive bitrate controller, moves along a ladder of ( width, height, fps, JPEG quality ) rungs from the peer's receiver reports
+ - congestion ( loss over LOSS_DOWN, round trip time well above the lowest seen or the peer receiving far less than was sent )
+   steps down at once, two rungs on heavy loss, then holds for HOLD_DOWN seconds
+ - stepping up needs up_after clean reports in a row ( loss under LOSS_UP ), between the two thresholds the rung is kept
+ - congestion soon after a step up doubles up_after, so a rung the link can't carry isn't retried every few seconds
+   a step up that holds halves it again
+ - every decision is printed & kept in decisions
+"""
+class rateController:
+    LADDER = ((320, 180, 10, 30), (320, 180, 15, 35), (480, 270, 15, 35), (640, 360, 20, 40),
+              (640, 360, 30, 40), (960, 540, 30, 45), (1280, 720, 30, 50))
+    LOSS_DOWN = 0.10
+    LOSS_UP = 0.02
+    HEAVY_LOSS = 0.25
+    HOLD_DOWN = 2.0
+    UP_PROBATION = 10.0     # seconds after a step up in which congestion counts against it
+    MAX_UP_AFTER = 60
+
+    def __init__(self, max_size=(1280, 720), start=4, up_after=5):
+        self.ladder = [rung for rung in self.LADDER if rung[0] <= max_size[0] and rung[1] <= max_size[1]] or [self.LADDER[0]]
+        self.index = min(start, len(self.ladder) - 1)
+        self.base_up_after = up_after
+        self.up_after = up_after
+        self.good_reports = 0
+        self.hold_until = 0.0
+        self.last_up = None
+        self.min_rtt = None
+        self.report = None
+        self.decisions = collections.deque(maxlen=20)
+
+    def rung(self):
+        return self.ladder[self.index]
+
+    """
+    takes one receiver report ( bytes/s received, loss fraction, rtt in seconds or None ) & the bytes/s sent meanwhile
+    returns the new rung when it changed, otherwise None
+    """
+    def on_report(self, receive_rate, loss, rtt, sent_rate=None, now=None):
+        now = time.monotonic() if now is None else now
+        self.report = {"receive_rate": receive_rate, "loss": loss, "rtt": rtt, "sent_rate": sent_rate}
+        if rtt is not None:
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+
+        reason = None
+        if loss > self.LOSS_DOWN:
+            reason = f"loss {loss * 100:.0f} %"
+        elif rtt is not None and rtt > self.min_rtt * 2 + 0.1:
+            reason = f"rtt {rtt * 1000:.0f} ms ( min {self.min_rtt * 1000:.0f} ms )"
+        elif sent_rate and receive_rate < 0.7 * sent_rate:
+            reason = f"received {receive_rate * 8 / 1000:.0f} of {sent_rate * 8 / 1000:.0f} kbps"
+
+        if reason is not None:
+            self.good_reports = 0
+            if now < self.hold_until:
+                return None
+            if self.last_up is not None and now - self.last_up < self.UP_PROBATION:
+                self.up_after = min(self.up_after * 2, self.MAX_UP_AFTER)
+            self.last_up = None
+            return self.move(-2 if loss > self.HEAVY_LOSS else -1, now, reason)
+
+        if loss < self.LOSS_UP:
+            # a step up that held through its probation earns back some patience
+            if self.last_up is not None and now - self.last_up >= self.UP_PROBATION:
+                self.up_after = max(self.base_up_after, self.up_after // 2)
+                self.last_up = None
+            self.good_reports += 1
+            if self.good_reports >= self.up_after and now >= self.hold_until:
+                self.good_reports = 0
+                return self.move(1, now, f"{self.up_after} clean reports")
+        else:
+            self.good_reports = 0
+        return None
+
+    def move(self, steps, now, reason):
+        index = max(0, min(len(self.ladder) - 1, self.index + steps))
+        if index == self.index:
+            return None
+        old = self.ladder[self.index]
+        self.index = index
+        if steps < 0:
+            self.hold_until = now + self.HOLD_DOWN
+        else:
+            self.last_up = now
+        new = self.ladder[index]
+        decision = f"{'down' if steps < 0 else 'up'} {old[0]}x{old[1]} {old[2]} fps q{old[3]} -> {new[0]}x{new[1]} {new[2]} fps q{new[3]} ( {reason} )"
+        self.decisions.append((time.time(), decision))
+        print(f"Video rate: {decision}")
+        return new
+
+    def get_stats(self):
+        width, height, fps, quality = self.rung()
+        return {"width": width, "height": height, "fps": fps, "quality": quality, "report": self.report,
+                "up_after": self.up_after, "decisions": list(self.decisions)}
+
 
 class videoConnect:
-    def __init__(self, deviceIndex=0, height=640, width=480):
+    active = None   # call in progress, read by the Analytics tab
+    REPORT_INTERVAL = 1.0
+
+    def __init__(self, deviceIndex=0, width=640, height=480, mjpeg=True, tiles=False, simulcast=False):
         self.camera = cv2.VideoCapture(deviceIndex)
 
-        self.resolution = [height, width]
-        self.camera.set(3, width)
-        self.camera.set(4, height)
+        self.resolution = [width, height]
+        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+        # ask for the camera's own JPEGs so they can be sent without decoding & re-encoding them
+        # checked on the first frame, backends that still deliver BGR fall back to encoding
+        self.mjpeg = mjpeg
+        if mjpeg:
+            self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+            self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        self.self_view_visible = True
+        self.self_view_size = (240, 135)
+
+        # captured, resized & decoded frames are recycled through one pool, shared with the display
+        self.frame_pool = framePool()
 
-        self.video_queue = queue.Queue(maxsize=10)
-        self.user_video_queue = queue.Queue(maxsize=20)
+        # compressed frames from header, decoded into decoder.frames
+        self.video_queue = queue.Queue(maxsize=2)
+        self.decoder = decodeWorker(self.video_queue, frame_pool=self.frame_pool)
+        self.user_video = frameMailbox(self.frame_pool)
 
         self.sendFrameDuration = 0
+        self.frame_id = 0
         self.receiveFrameDuration = 0
 
         self.headerClass = header()
+        self.encoder = None
+
+        # tile mode only sends the parts of the frame that changed
+        # simulcast sends full, half & quarter size layers of every frame, the peer subscribes to the one it shows
+        # the two don't mix, a layer switch would need a tile refresh, so simulcast turns tiles off
+        self.simulcast = simulcast
+        self.tiles = tileEncoder() if tiles and not simulcast else None
+        self.peer = None    # ( socket, address ) once network_video runs, for control messages
+        self.decoder.on_loss = self.request_keyframe
+
+        # rate control, the receiving header is measured for our reports & the peer's reports drive the controller
+        self.rate = rateController(max_size=(width, height))
+        self.frame_interval = 1 / self.rate.rung()[2]
+        self.receiver = None
+        self.bytes_sent = 0
+        self.sent_rate = None
+        self.sender_report = None   # ( peer clock, local time it arrived )
+
+        # set by set_display when frames are shown in the Lightwave window instead of cv2 windows
+        self.on_self_frame = None
 
         self.sending = True
     
 
 
     """
-    Records the video data from user and 
+    Records the video data from user and puts the newest frame in the user_video mailbox
+     - older frames nobody took yet are overwritten, send & play always get the latest
+     - BGR frames are read into buffers from frame_pool, camera JPEGs change size every frame so they aren't pooled
+     - the first frame decides the format, BGR or raw frames that aren't JPEGs ( e.g. YUYV ) turn the camera's RGB conversion back on
     """
     def get_video(self, cameraOn=True):
+        shape = None
+        checked = False
+        try:
+            while self.sending:
 
-        while self.sending:
+                # retrives image and saves it to frame
+                #   if fails retval is false
+                if shape is not None:
+                    buffer = self.frame_pool.acquire(shape)
+                    retval, frame = self.camera.read(image=buffer)
+                    if frame is not buffer:
+                        self.frame_pool.release(buffer)
+                else:
+                    retval, frame = self.camera.read()
 
-            # retrives image and saves it to frame
-            #   if fails retval is false
-            retval, frame = self.camera.read()
-            
-            if not retval:
-                print("False")
-                raise Exception("Could not retrieve from camera")
+                if not retval:
+                    print("False")
+                    raise Exception("Could not retrieve from camera")
 
+                if not checked:
+                    if is_compressed(frame) and jpeg_size(frame) is None:
+                        if not self.mjpeg:
+                            raise Exception("Camera frames are neither BGR nor JPEG")
+                        self.mjpeg = False
+                        self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                        continue    # this raw frame can't be used, the next one is converted
+                    if self.mjpeg and not is_compressed(frame):
+                        self.mjpeg = False
+                        self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                    checked = True
 
-            # Adds frame to queue for user playback
-            if self.user_video_queue.full():
-                while not self.user_video_queue.empty():
-                    try:
-                        self.user_video_queue.get_nowait()
-                    except queue.Empty:
-                        break
-            else:
-                self.user_video_queue.put_nowait(frame)
-                self.user_video_queue.put_nowait(frame)
+                shape = frame.shape if not is_compressed(frame) else None
+
+                self.user_video.put(frame)
+                on_self_frame = self.on_self_frame
+                if on_self_frame is not None and self.self_view_visible:
+                    on_self_frame(self.self_view_frame(frame))
+                self.frame_pool.release(frame)
+        finally:
+            self.user_video.close()
 
 
 
     """
-    Uses socket and cv2 to record video data and send it to the client
+    Frame for the self view, camera JPEGs are only decoded here & at the self view's size
     """
-    def send_video(self, socket, client_address):
-        while self.sending:
-            try:
-                frame = self.user_video_queue.get_nowait()
-
-                sendLastTime = time.time()
-
-                retval, bufferSend = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 40] )
-                self.headerClass.send_data(socket=socket, addr=client_address, data_type=1, seq_num=0, data_send=pickle.dump(bufferSend), timestamp=int(time.time()))
-                
-                self.sendFrameDuration = time.time() - sendLastTime()
-            except Exception as E:
-                print(f"Error in send_video: {E}")
-                pass
+    def self_view_frame(self, frame):
+        if not is_compressed(frame):
+            return frame
+        size = jpeg_size(frame)
+        flag = reduced_decode(*size, *self.self_view_size)[1] if size else cv2.IMREAD_COLOR
+        return cv2.imdecode(frame.reshape(-1), flag)
 
 
 
     """
-    Uses socket to receive a frame that will be displayed
+    Uses socket and cv2 to record video data and send it to the client
+     - frames are encoded on the encodePipeline pool & sent in order from its workers
+     - each encoded frame is split into MTU sized chunks by header.send_frame
+     - with simulcast a simulcastEncoder encodes every layer & the chunks are tagged with their layer
     """
-    def recieve_video(self, socket):
-        while self.sending:
-            try:
-                recieveLastTime = time.time()
+    def send_video(self, socket, client_address):
+        def send_encoded(frame_id, payload, layer=0):
+            self.headerClass.send_frame(socket=socket, addr=client_address, frame_id=frame_id, data_send=payload, timestamp=int(time.time()), layer=layer)
+            self.frame_id = frame_id
+            self.bytes_sent += payload_size(payload)
+
+        width, height, fps, quality = self.rate.rung()
+        if self.simulcast:
+            self.encoder = simulcastEncoder(send_encoded, quality=quality, max_size=(width, height), frame_pool=self.frame_pool)
+        else:
+            self.encoder = encodePipeline(send_encoded, quality=quality, max_size=(width, height), tiles=self.tiles, frame_pool=self.frame_pool)
+        generation = 0
+        last_submit = 0.0
+        try:
+            while self.sending:
+                frame, generation = self.user_video.get(generation, timeout=0.5)
+                # frames faster than the rung's frame rate are left out
+                now = time.monotonic()
+                if frame is not None and now - last_submit >= self.frame_interval * 0.9:
+                    last_submit = now
+                    self.encoder.submit(frame)
+                    self.sendFrameDuration = self.encoder.encode_time
+                if frame is not None:
+                    self.frame_pool.release(frame)
+        finally:
+            self.encoder.close()
 
-                header.receive_data(socket=socket)
-                
-                self.receiveFrameDuration = time.time() - recieveLastTime
-            except Exception as E:
-                print(f"Error in recieve_video: {E}")
-                pass
 
 
     """
@@ -108,53 +1007,205 @@ class videoConnect:
         User frame is grabbed from same frame being sent to the other user
 
     Client:
-        Client frame is recieved by the heaeder class and being inputed into the video_queue
+        Client frame is recieved by the heaeder class, decoded by the decoder & taken from its mailbox
     """
     def play_video(self):
+        generation = 0
+        client_generation = 0
         while self.sending:
-            try:
-                if not self.user_video_queue.empty():
-                    cv2.imshow("my camera", self.user_video_queue.get_nowait())
-                if not self.video_queue.empty():
-                    cv2.imshow("Client camera", self.video_queue.get_nowait())
-            except queue.Empty:
-                pass
+            frame, generation = self.user_video.get(generation, timeout=0.01)
+            if frame is not None:
+                cv2.imshow("my camera", frame if not is_compressed(frame) else cv2.imdecode(frame.reshape(-1), cv2.IMREAD_COLOR))
+                self.frame_pool.release(frame)
+            frame, client_generation = self.decoder.frames.get(client_generation, timeout=0)
+            if frame is not None:
+                cv2.imshow("Client camera", frame)
+                self.frame_pool.release(frame)
 
             if cv2.waitKey(1) & 0xFF == ord("q"):
                 break
 
 
 
+    """
+    Shows the client's & the user's frames through callbacks ( e.g. UI.videoWidget ) instead of play_video's cv2 windows
+     - callbacks run on the decode & capture threads, None stops sending frames to them
+    """
+    def set_display(self, on_frame, on_self_frame):
+        self.decoder.listener = on_frame
+        self.on_self_frame = on_self_frame
+
+    # size in pixels the client's video is shown at, decoding is scaled down to it
+    def set_render_size(self, width, height):
+        self.decoder.set_render_size(width, height)
+
+    """
+    Control messages from the peer, set as the receiving header's control listener
+    """
+    def handle_control(self, message):
+        kind = message[0]
+        fields = memoryview(message)[control_struct.size:]
+        if kind == KEYFRAME_REQUEST and self.tiles is not None:
+            self.tiles.request_refresh()
+        elif kind == SENDER_REPORT and len(fields) >= sender_report_struct.size:
+            self.sender_report = (sender_report_struct.unpack_from(fields)[0], time.monotonic())
+        elif kind == RECEIVER_REPORT and len(fields) >= receiver_report_struct.size:
+            receive_rate, loss, echo, held = receiver_report_struct.unpack_from(fields)
+            rtt = ((report_clock() - echo) & 0xFFFFFFFF) - held if echo else None
+            rung = self.rate.on_report(receive_rate, loss / 1000, rtt / 1000 if rtt is not None else None, self.sent_rate)
+            if rung is not None:
+                self.apply_rung(rung)
+        elif kind == LAYER_SUBSCRIBE and len(fields) >= layer_subscribe_struct.size:
+            encoder = self.encoder
+            if isinstance(encoder, simulcastEncoder):
+                encoder.subscribe(layer_subscribe_struct.unpack_from(fields)[0])
+
+    def apply_rung(self, rung):
+        width, height, fps, quality = rung
+        self.frame_interval = 1 / fps
+        if self.encoder is not None:
+            self.encoder.set_target(quality, (width, height))
+
+    # set by the call to the header that receives from the peer, our receiver reports are measured on it
+    def set_receiver(self, receiver):
+        self.receiver = receiver
+
+    """
+    Every REPORT_INTERVAL sends a sender report ( our clock, for the peer's rtt ) & a receiver report on the video we received
+     - & the simulcast layer wanted, when the peer sends layers
+    """
+    def report_video(self):
+        bytes_sent = self.bytes_sent
+        received = lost = bytes_received = 0
+        last = time.monotonic()
+        while self.sending:
+            time.sleep(self.REPORT_INTERVAL)
+            if self.peer is None:
+                continue
+            socket, address = self.peer
+            now = time.monotonic()
+            elapsed = now - last
+            last = now
+            self.sent_rate = (self.bytes_sent - bytes_sent) / elapsed
+            bytes_sent = self.bytes_sent
+            try:
+                self.headerClass.send_control(socket, address, SENDER_REPORT, sender_report_struct.pack(report_clock()))
+                if self.receiver is None:
+                    continue
+                chunks_received, chunks_lost = self.receiver.video_chunk_counts()
+                new_received, new_lost = chunks_received - received, chunks_lost - lost
+                received, lost = chunks_received, chunks_lost
+                rate = (self.receiver.video_bytes_received - bytes_received) / elapsed
+                bytes_received = self.receiver.video_bytes_received
+                loss = int(new_lost * 1000 / (new_received + new_lost)) if new_received + new_lost else 0
+                echo, held = 0, 0
+                if self.sender_report is not None:
+                    echo, arrived = self.sender_report
+                    held = int((now - arrived) * 1000)
+                fields = receiver_report_struct.pack(min(int(rate), 0xFFFFFFFF), min(loss, 1000), echo, min(held, 0xFFFFFFFF))
+                self.headerClass.send_control(socket, address, RECEIVER_REPORT, fields)
+                self.subscribe_layers(socket, address)
+            except OSError as E:
+                print(f"Error in report_video: {E}")
+
+    """
+    Picks the smallest simulcast layer that still covers the render size & subscribes to it
+     - the layer shown stays subscribed until the decoder has moved to the new one, so the video doesn't stall in between
+     - nothing is sent while the peer only sends layer 0 ( no simulcast )
+    """
+    def subscribe_layers(self, socket, address):
+        decoder = self.decoder
+        layer, source_size = decoder.layer, decoder.source_size
+        scales = simulcastEncoder.SCALES
+        if decoder.layers_seen <= 1 or layer is None or layer >= len(scales) or source_size is None:
+            return
+        full_width, full_height = source_size[0] * scales[layer], source_size[1] * scales[layer]
+        fit = min(decoder.size[0] / full_width, decoder.size[1] / full_height)
+        wanted = max([n for n, scale in enumerate(scales) if 1 / scale >= fit], default=0)
+        decoder.wanted_layer = wanted
+        mask = (1 << wanted) | (1 << layer)
+        self.receiver.set_video_layers(mask)
+        self.headerClass.send_control(socket, address, LAYER_SUBSCRIBE, layer_subscribe_struct.pack(mask))
+
+    # asks the peer for a full tile refresh after received video was lost
+    def request_keyframe(self):
+        if self.peer is not None:
+            self.headerClass.send_control(self.peer[0], self.peer[1], KEYFRAME_REQUEST)
+
+    # camera JPEGs are only decoded for the self view while it is visible
+    def set_self_view(self, visible, width=None, height=None):
+        self.self_view_visible = visible
+        if width and height:
+            self.self_view_size = (int(width), int(height))
+
+
+
     """
     States threads for video
     Sends & Recieves video data
+     - the cv2 play_video thread only runs when no display was set
     Once over ends camera
     """
     def network_video(self, socket, client_address):
-        self.headerClass.set_video_queue(video_queue=self.video_queue)
-
+        self.peer = (socket, client_address)
+        videoConnect.active = self
+        report_thread = threading.Thread(target=self.report_video, args=(), name="reportVideoThread", daemon=True)
+        report_thread.start()
         get_thread = threading.Thread(target=self.get_video, args=(), name="getVideoThread")
+        send_thread = threading.Thread(target=self.send_video, args=(socket, client_address), name="sendVideoThread")
         play_thread = threading.Thread(target=self.play_video, args=(), name="playVideoThread")
+        decode_thread = threading.Thread(target=self.decoder.run, args=(), name="decodeVideoThread")
+        use_play_thread = self.decoder.listener is None and self.on_self_frame is None
         get_thread.start()
-        play_thread.start()
+        send_thread.start()
+        if use_play_thread:
+            play_thread.start()
+        decode_thread.start()
 
 
         try:
             get_thread.join()
-            play_thread.join()
+            send_thread.join()
+            if use_play_thread:
+                play_thread.join()
         except KeyboardInterrupt:
+            self.sending = False
+            self.user_video.close()
             print("Stopping network audio threads.")
             self.camera.release()
             cv2.destroyAllWindows()
             pass
+        finally:
+            self.decoder.stop()
+            decode_thread.join()
+            if videoConnect.active is self:
+                videoConnect.active = None
+
 
 
+    # capture fps, frames overwritten before anyone took them & capture to consume age
+    def get_capture_stats(self):
+        return self.user_video.get_stats()
 
+    # encode time, frames in flight, sent fps & frames dropped because encode was behind
+    def get_encode_stats(self):
+        return self.encoder.get_stats() if self.encoder else None
 
+    # decode time, arrival to decoded latency & frames skipped because decode was behind
+    def get_decode_stats(self):
+        return self.decoder.get_stats()
 
+    # current rung, the last receiver report & recent decisions of the rate controller
+    def get_rate_stats(self):
+        return self.rate.get_stats()
 
+    # frame buffer reuse, hit rate & the most memory the pool held
+    def get_frame_pool_stats(self):
+        return self.frame_pool.get_stats()
 
-        
+    # share of tiles sent & refreshes, None when tile mode is off
+    def get_tile_stats(self):
+        return self.tiles.get_stats() if self.tiles else None
 
 
 
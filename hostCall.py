@@ -84,30 +84,33 @@ runs when a local call is started
 generates a key based off your local IP address
     videoDevice - Video Device Index
     audioDevice - Audio Device Index
+    display - optional UI.clientWindow the call's video is shown in
 """
-def hostLocal(callSettings):
+def hostLocal(callSettings, display=None):
     hostIP = get_local_ip()
     print("host local")
-    host( hostIP, callSettings )
+    host( hostIP, callSettings, display )
 
 
 """
 Runs when a online call is started
 generates a key off your public IP address
 """
-def hostPublic(callSettings):
+def hostPublic(callSettings, display=None):
     hostIP = get_public_ip()
     print("Host public")
-    host( hostIP, callSettings )
+    host( hostIP, callSettings, display )
 
 
 """
 Creates a UDP connection from socket through your IP and port number 5060
 """
-def host( hostIP, callSettings):
+def host( hostIP, callSettings, display=None ):
     print(callSettings)
-    audioConnectClass = audioConnect(inputIndex=callSettings["inputDevice"], outputIndex=callSettings["outputDevice"], inputVolume=callSettings["inputVolume"], outputVolume=callSettings["outputVolume"])
-    videoConnectClass = videoConnect(deviceIndex=callSettings["videoDevice"])
+    audioConnectClass = audioConnect(inputIndex=callSettings["inputDevice"], outputIndex=callSettings["outputDevice"], inputVolume=callSettings["inputVolume"], outputVolume=callSettings["outputVolume"], codec=callSettings["audioCodec"], mono=callSettings["audioMono"], frame_duration=callSettings["audioFrameDuration"], dtx=callSettings["audioDTX"], echo_cancel=callSettings["audioEchoCancel"])
+    videoConnectClass = videoConnect(deviceIndex=callSettings["videoDevice"], tiles=callSettings["videoTiles"], simulcast=callSettings["videoSimulcast"])
+    if display is not None:
+        display.attach( videoConnectClass )
     chatConnectClass = chatConnect()
     headerClass = header()
 
@@ -124,7 +127,13 @@ def host( hostIP, callSettings):
     audio_thread = threading.Thread( target=audioConnectClass.network_audio, args=( host_socket, client_address ), name="hostAudioThread" )
     chat_thread = threading.Thread( target=chatConnectClass.network_chat, args=( host_socket, client_address ), name="hostChatThread" )
     video_thread = threading.Thread( target=videoConnectClass.network_video, args=( host_socket, client_address ), name="hostVideoThread" )
-    received_thread = threading.Thread( target=headerClass.receive_data, args=( host_socket, ), name="receivedDataThread" )
+    # single reader of the socket, routes every packet to the queue of its media
+    headerClass.set_audio_queue( audio_queue=audioConnectClass.audio_queue )
+    headerClass.set_video_queue( video_queue=videoConnectClass.video_queue )
+    headerClass.set_chat_queue( chat_queue=chatConnectClass.chat_queue )
+    headerClass.set_control_listener( control_listener=videoConnectClass.handle_control )
+    videoConnectClass.set_receiver( headerClass )
+    received_thread = threading.Thread( target=headerClass.receive_loop, args=( host_socket, ), name="receivedDataThread" )
 
     audio_thread.start()
     chat_thread.start()
@@ -139,5 +148,6 @@ def host( hostIP, callSettings):
         audio_thread.join()
         chat_thread.join()
         video_thread.join()
+        headerClass.stop_receiving()
         received_thread.join()
         host_socket.close()
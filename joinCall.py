@@ -19,10 +19,12 @@ import threading
 """
 run when joinning a peer
 """
-def peer( key, callSettings ): # run by peer
+def peer( key, callSettings, display=None ): # run by peer
     print(callSettings)
-    audioConnectClass = audioConnect(inputIndex=callSettings["inputDevice"], outputIndex=callSettings["outputDevice"], inputVolume=callSettings["inputVolume"], outputVolume=callSettings["outputVolume"])
-    videoConnectClass = videoConnect(deviceIndex=callSettings["videoDevice"])
+    audioConnectClass = audioConnect(inputIndex=callSettings["inputDevice"], outputIndex=callSettings["outputDevice"], inputVolume=callSettings["inputVolume"], outputVolume=callSettings["outputVolume"], codec=callSettings["audioCodec"], mono=callSettings["audioMono"], frame_duration=callSettings["audioFrameDuration"], dtx=callSettings["audioDTX"], echo_cancel=callSettings["audioEchoCancel"])
+    videoConnectClass = videoConnect(deviceIndex=callSettings["videoDevice"], tiles=callSettings["videoTiles"], simulcast=callSettings["videoSimulcast"])
+    if display is not None:
+        display.attach( videoConnectClass )
     chatConnectClass = chatConnect()
     headerClass = header()
 
@@ -47,7 +49,13 @@ def peer( key, callSettings ): # run by peer
     audio_thread = threading.Thread( target=audioConnectClass.network_audio, args=( host_socket, host_address ), name="peerAudioThread" )
     chat_thread = threading.Thread( target=chatConnectClass.network_chat, args=( host_socket, host_address ), name="peerChatThread" )
     video_thread = threading.Thread( target=videoConnectClass.network_video, args=( host_socket, host_address ), name="peerVideoThread" )
-    received_thread = threading.Thread( target=headerClass.receive_data, args=( host_socket, ), name="receivedDataThread" )
+    # single reader of the socket, routes every packet to the queue of its media
+    headerClass.set_audio_queue( audio_queue=audioConnectClass.audio_queue )
+    headerClass.set_video_queue( video_queue=videoConnectClass.video_queue )
+    headerClass.set_chat_queue( chat_queue=chatConnectClass.chat_queue )
+    headerClass.set_control_listener( control_listener=videoConnectClass.handle_control )
+    videoConnectClass.set_receiver( headerClass )
+    received_thread = threading.Thread( target=headerClass.receive_loop, args=( host_socket, ), name="receivedDataThread" )
 
     audio_thread.start()
     chat_thread.start()
@@ -62,5 +70,6 @@ def peer( key, callSettings ): # run by peer
         audio_thread.join()
         chat_thread.join()
         video_thread.join()
+        headerClass.stop_receiving()
         received_thread.join()
         host_socket.close()
\ No newline at end of file
@@ -27,6 +27,7 @@ from PySide6.QtWidgets import (QApplication, QCalendarWidget, QCheckBox, QComboB
                                 QWidget, QHeaderView, QInputDialog, QTabWidget, QGroupBox)
 
 from connection.header import header
+from UI.clientWindow import ClientWindow
 
 from utilities import (SCHEDULED_CALLS_FILE, CONTACTS_FILE, SETTING_FILE, 
                        app_data_dir, call_history,
@@ -37,6 +38,7 @@ from utilities import (SCHEDULED_CALLS_FILE, CONTACTS_FILE, SETTING_FILE,
 
 
 import os
+import threading
 
 #
 # Set up
@@ -249,7 +251,7 @@ class HomeTab(QWidget):
             callSettings = get_call_settings()
 
             print('Hosting Local')
-            hostLocal(callSettings=callSettings)
+            self.start_call(hostLocal, callSettings=callSettings)
 
     '''
     Runs once Host Public is clicked
@@ -281,7 +283,7 @@ class HomeTab(QWidget):
             callSettings = get_call_settings()
 
             print('Host Public')
-            hostPublic(callSettings=callSettings)
+            self.start_call(hostPublic, callSettings=callSettings)
 
 
     def join_call(self):
@@ -289,7 +291,16 @@ class HomeTab(QWidget):
         if okPressed and len(enteredKey) > 2:
             from joinCall import peer
             callSettings = get_call_settings()
-            peer(enteredKey, callSettings=callSettings)
+            self.start_call(peer, enteredKey, callSettings=callSettings)
+
+    '''
+    Runs a call off the GUI thread & shows its video in a ClientWindow
+    '''
+    def start_call(self, call, *args, **kwargs):
+        self.client_window = ClientWindow()
+        self.client_window.show()
+        call_thread = threading.Thread(target=call, args=args, kwargs=dict(kwargs, display=self.client_window), name="callThread", daemon=True)
+        call_thread.start()
 
     def update_clock(self):
         self.clock_widget.setDateTime(QDateTime.currentDateTime())
@@ -838,13 +849,6 @@ class AboutTab(QWidget):
         self.setLayout(layout)  
 
 
-'''
-Client active window
-'''
-class ClientWindow(QWidget):
-    def __init__(self, parent = None):
-        super().__init__(parent)
-        self.setWindowTitle("Client Communications")
 
 
 
@@ -119,7 +119,14 @@ def save_default(): # consider check for settings integrity?
         "inputDevice": get_default_audio_input_device(),
         "outputDevice": get_default_audio_output_device(),
         "inputVolume": 100,
-        "outputVolume": 100
+        "outputVolume": 100,
+        "audioCodec": "pcm16",
+        "audioMono": "False",
+        "audioFrameDuration": 20,
+        "audioDTX": "True",
+        "audioEchoCancel": "True",
+        "videoTiles": "False",
+        "videoSimulcast": "False"
     }
     with open(SETTING_FILE, "w", encoding="utf-8") as f:
         json.dump([DEFAULT_SETTINGS], f, indent=4)
@@ -150,7 +157,7 @@ def update_settings(settingName, settingNewValue):
 def get_call_settings():
     with open(SETTING_FILE, "r", encoding="utf-8") as f:
         settings = json.load(f)[0]
-    return {"videoDevice":get_device_id(settings['videoDevice']), "inputDevice":get_device_id(settings['inputDevice']), "outputDevice":get_device_id(settings['outputDevice']), "inputVolume":settings["inputVolume"], "outputVolume":settings["outputVolume"]}
+    return {"videoDevice":get_device_id(settings['videoDevice']), "inputDevice":get_device_id(settings['inputDevice']), "outputDevice":get_device_id(settings['outputDevice']), "inputVolume":settings["inputVolume"], "outputVolume":settings["outputVolume"], "audioCodec":settings.get("audioCodec", "pcm16"), "audioMono":settings.get("audioMono", "False") == "True", "audioFrameDuration":settings.get("audioFrameDuration", 20), "audioDTX":settings.get("audioDTX", "True") == "True", "audioEchoCancel":settings.get("audioEchoCancel", "True") == "True", "videoTiles":settings.get("videoTiles", "False") == "True", "videoSimulcast":settings.get("videoSimulcast", "False") == "True"}
 
 
 # 